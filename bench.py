@@ -0,0 +1,398 @@
+# bench.py - offline throughput benchmark for the bot's handlers
+# Usage: python bench.py [--users 200] [--join-batch 10] [--concurrency 50] [--rtt 0.05] [--mongo URI]
+# Needs `pip install mongomock` (unless --mongo) and ffmpeg for the voice phase.
+#
+# Runs the real start_bot() against an in-process fake Telegram client and
+# mongomock (or a *scratch* mongod via --mongo; the telegram_bot database on
+# it is written to), then replays five phases with synthetic events:
+#
+#   greet     - "hi" DMs (NewMessage, text, through the private-message router)
+#   join      - one ChatAction join per user
+#   join-many - ChatActions adding `--join-batch` new users each (bulk upsert path)
+#   voice     - generated OGG/Opus notes of several lengths (NewMessage, voice, routed)
+#   moderate  - approve/reject button clicks (CallbackQuery)
+#
+# Each phase reports events/sec, p50/p99 handler latency, p50/p99 time to
+# the first reply or callback answer ("ack") and event-loop lag. Both join
+# phases go well past JOIN_STORM_THRESHOLD, so join-storm mode is exercised;
+# the per-lane outbox latencies at the end show how long its welcomes waited.
+# Any Config value can be overridden through the environment as usual, e.g.
+# VOICE_WORKERS=4 DB_WORKERS=8 python bench.py --users 500
+#
+# Telegram's per-chat limits are lifted for the first four phases so those
+# numbers reflect the bot itself, and kept for the moderate phase, where the
+# admin waits on them (`--chat-limits` keeps them everywhere; add
+# SEND_RATE=25 for production's global pacing too).
+
+import os, sys, time, random, asyncio, logging, argparse, itertools, subprocess
+
+# Settings the bot needs at import time; real values are never used
+BENCH_ENV = {
+    "API_ID": "1",
+    "API_HASH": "bench",
+    "BOT_TOKEN": "bench",
+    "GROUP_ID": "-1001000000001",
+    "MODLOG_CHAT": "-1001000000002",
+    "ADMINS": "1000",
+    "METRICS_PORT": "0",
+    # Telegram's ~30/s global limit would cap every phase; set SEND_RATE=25 to keep it
+    "SEND_RATE": "100000",
+    # Fixtures are reused across users, so only flag duplicates by default
+    "DUPLICATE_ACTION": "flag",
+}
+ADMIN_ID = 1000
+FIRST_USER_ID = 10_000_000
+
+logger = logging.getLogger("bench")
+
+
+# ---------------- Fake Telegram ----------------
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self._ids)
+
+
+class FakeClient:
+    """Stands in for TelegramClient: records handlers, every API call just sleeps `rtt`."""
+
+    rtt = 0.05
+
+    def __init__(self, *args, **kwargs):
+        self.handlers = {}
+        self.calls = 0
+        self.ready = asyncio.Event()
+        self._disconnected = asyncio.Event()
+
+    def on(self, builder):
+        def decorator(fn):
+            self.handlers[fn.__name__] = fn
+            return fn
+        return decorator
+
+    async def start(self, **kwargs):
+        return self
+
+    async def run_until_disconnected(self):
+        self.ready.set()
+        await self._disconnected.wait()
+
+    def is_connected(self):
+        return not self._disconnected.is_set()
+
+    async def disconnect(self):
+        self._disconnected.set()
+
+    async def call(self, *args, **kwargs):
+        await asyncio.sleep(self.rtt)
+        self.calls += 1
+        return FakeMessage()
+
+    send_message = edit_permissions = kick_participant = call
+
+    async def iter_participants(self, entity, filter=None):
+        # The startup reconciliation sweep finds an empty group
+        return
+        yield
+
+    async def get_input_entity(self, user_id):
+        from telethon.tl import types
+        await asyncio.sleep(self.rtt)
+        return types.InputPeerUser(user_id, user_id * 7)
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.first_name = f"Bench {user_id}"
+        self.username = None
+        self.access_hash = user_id * 7
+        self.bot = False
+
+
+class FakeFile:
+    def __init__(self, duration, size):
+        self.duration = duration
+        self.size = size
+
+
+class FakeDocument:
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = next(self._ids)
+
+
+class FakeEvent:
+    """The subset of Telethon's event attributes the handlers touch."""
+
+    def __init__(self, client, chat_id, sender_id, user=None):
+        self.client = client
+        self.chat_id = chat_id
+        self.sender_id = sender_id
+        self.user = user
+        self.is_private = chat_id > 0
+        self.text = ""
+        self.voice = None
+        self.responded = None  # perf_counter of the first reply/answer
+
+    def _respond(self):
+        if self.responded is None:
+            self.responded = time.perf_counter()
+
+    async def get_sender(self):
+        return self.user
+
+    async def get_user(self):
+        return self.user
+
+    async def reply(self, *args, **kwargs):
+        self._respond()
+        return await self.client.call()
+
+    async def edit(self, *args, **kwargs):
+        return await self.client.call()
+
+    async def answer(self, *args, **kwargs):
+        self._respond()
+        return await self.client.call()
+
+    async def delete(self):
+        return await self.client.call()
+
+
+def greet_event(client, user):
+    event = FakeEvent(client, user.id, user.id, user)
+    event.text = "hi"
+    return event
+
+
+def join_event(client, group_id, *users):
+    event = FakeEvent(client, group_id, users[0].id, users[0])
+    event.action_message = None
+    event.user_joined, event.user_added = len(users) == 1, len(users) > 1
+    event.users = list(users)
+    return event
+
+
+def voice_event(client, user, fixture, download_delay):
+    duration, data = fixture
+    event = FakeEvent(client, user.id, user.id, user)
+    event.voice = True
+    event.file = FakeFile(duration, len(data))
+    event.document = FakeDocument()
+
+    async def download_media(file=None):
+        await asyncio.sleep(download_delay)
+        return data
+
+    async def forward_to(chat_id):
+        return await client.call()
+
+    event.download_media = download_media
+    event.forward_to = forward_to
+    return event
+
+
+def callback_event(client, chat_id, user, action):
+    event = FakeEvent(client, chat_id, ADMIN_ID)
+    event.data = f"{action}_{user.id}".encode()
+    return event
+
+
+# ---------------- Fixtures ----------------
+def make_fixture(ffmpeg, seconds, seed):
+    """Speech-like OGG/Opus: pink noise with a syllable-rate amplitude envelope."""
+    source = (
+        f"anoisesrc=color=pink:amplitude=0.4:seed={seed}:duration={seconds},"
+        f"tremolo=f={2 + seed % 5}:d=0.9"
+    )
+    proc = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-f", "lavfi", "-i", source,
+         "-ac", "1", "-ar", "48000", "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"],
+        capture_output=True, check=True,
+    )
+    return seconds, proc.stdout
+
+
+# ---------------- Measurement ----------------
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def watch_loop_lag(samples, interval=0.01):
+    """How late the loop wakes up a sleeper: a direct measure of blocking work."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - start - interval)
+
+
+async def run_phase(name, handler, events, concurrency):
+    latencies, acks, lag = [], [], []
+    slots = asyncio.Semaphore(concurrency)
+
+    async def dispatch(event):
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await handler(event)
+            except Exception as e:
+                logger.warning(f"⚠️ {name} handler raised {type(e).__name__}: {e}")
+            latencies.append(time.perf_counter() - start)
+            if event.responded is not None:
+                acks.append(event.responded - start)
+
+    watcher = asyncio.create_task(watch_loop_lag(lag))
+    start = time.perf_counter()
+    await asyncio.gather(*(dispatch(e) for e in events))
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    return {
+        "phase": name,
+        "events": len(events),
+        "seconds": elapsed,
+        "rate": len(events) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "ack_p50": percentile(acks, 0.5) if acks else None,
+        "ack_p99": percentile(acks, 0.99) if acks else None,
+        "lag_p99": percentile(lag, 0.99),
+        "lag_max": max(lag, default=0.0),
+    }
+
+
+def print_report(results, drained_after, bot):
+    from metrics import STAGE_LATENCY, VOICE_REJECTIONS
+    print()
+    def ms(value):
+        return f"{value * 1000:.1f}" if value is not None else "–"
+
+    print(f"{'phase':<11}{'events':>8}{'ev/s':>10}{'p50 ms':>10}{'p99 ms':>10}"
+          f"{'ack p50':>10}{'ack p99':>10}{'lag p99':>10}{'lag max':>10}")
+    for r in results:
+        print(f"{r['phase']:<11}{r['events']:>8}{r['rate']:>10.1f}{ms(r['p50']):>10}{ms(r['p99']):>10}"
+              f"{ms(r['ack_p50']):>10}{ms(r['ack_p99']):>10}{ms(r['lag_p99']):>10}{ms(r['lag_max']):>10}")
+    print()
+    print("Stage p50/p99 (histogram bucket upper bounds):")
+    for (stage, op), _ in sorted(STAGE_LATENCY.series.items()):
+        p50 = STAGE_LATENCY.quantile(0.5, stage=stage, op=op)
+        p99 = STAGE_LATENCY.quantile(0.99, stage=stage, op=op)
+        print(f"  {stage + '/' + op:<52}{STAGE_LATENCY.count(stage=stage, op=op):>7}  ≤{p50 * 1000:g} ms  ≤{p99 * 1000:g} ms")
+    rejections = ", ".join(f"{k[0]}={v}" for k, v in sorted(VOICE_REJECTIONS.values.items())) or "none"
+    print(f"Voice rejections: {rejections}")
+    stats = bot.outbox.stats()
+    print(f"Outbox: {stats['sent']} sent, {stats['failed']} failed, drained {drained_after:.1f}s after the last phase")
+    for lane in stats["depth"]:
+        if stats["max_latency_ms"][lane]:
+            print(f"  {lane:<10}avg {stats['latency_ms'][lane]} ms, max {stats['max_latency_ms'][lane]} ms (queued → sent)")
+
+
+# ---------------- Main ----------------
+async def run(args):
+    import bot
+    from voice import FFMPEG
+
+    # Encode fixtures before the bot runs so the encoder doesn't show up as loop lag
+    fixtures = []
+    if bot.HAS_AUDIO:
+        fixtures = [make_fixture(FFMPEG, seconds, seed)
+                    for seconds in args.lengths for seed in range(args.variants)]
+    else:
+        logger.warning("⚠️ ffmpeg not found: skipping the voice phase")
+
+    chat_limits = bot.outbox.private_rate, bot.outbox.group_rate
+    if not args.chat_limits:
+        # Telegram's per-chat pacing would dominate these numbers; measure the bot instead
+        bot.outbox.set_chat_limits(1_000_000, 1_000_000)
+
+    client = bot.bot
+    task = asyncio.create_task(bot.start_bot())
+    await client.ready.wait()
+    h = client.handlers
+
+    random.seed(args.seed)
+    users = [FakeUser(FIRST_USER_ID + i) for i in range(args.users)]
+    # Joined in groups only, so each event takes the multi-user path
+    added = [FakeUser(FIRST_USER_ID + args.users + i) for i in range(args.users)]
+
+    results = [
+        await run_phase("greet", h["private_router"], [greet_event(client, u) for u in users], args.concurrency),
+        await run_phase("join", h["chat_action_handler"],
+                        [join_event(client, bot.Config.GROUP_ID, u) for u in users], args.concurrency),
+        await run_phase("join-many", h["chat_action_handler"], [
+            join_event(client, bot.Config.GROUP_ID, *added[i:i + args.join_batch])
+            for i in range(0, len(added), args.join_batch)
+        ], args.concurrency),
+    ]
+    if fixtures:
+        results.append(await run_phase("voice", h["private_router"], [
+            voice_event(client, u, random.choice(fixtures), args.download_delay) for u in users
+        ], args.concurrency))
+    # Admins wait on MODLOG_CHAT's 20/min and each user's 1/s: always measured with them
+    bot.outbox.set_chat_limits(*chat_limits)
+    results.append(await run_phase("moderate", h["approve_handler"], [
+        callback_event(client, bot.Config.MODLOG_CHAT, u, random.choice(("approve", "reject"))) for u in users
+    ], args.concurrency))
+
+    start = time.perf_counter()
+    await bot.modlog.close()
+    await bot.outbox.drain(timeout=args.drain_timeout)
+    drained_after = time.perf_counter() - start
+    await client.disconnect()
+    await task
+    if bot.analyzer:
+        bot.analyzer.close(wait=True)  # Otherwise the pool's feeder thread outlives its pipes at exit
+    bot.store.close()
+    print_report(results, drained_after, bot)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the guard bot's handlers")
+    parser.add_argument("--users", type=int, default=200, help="Synthetic users (events per phase)")
+    parser.add_argument("--join-batch", type=int, default=10, help="Users per ChatAction in the join-many phase")
+    parser.add_argument("--concurrency", type=int, default=50, help="Handlers in flight at once")
+    parser.add_argument("--rtt", type=float, default=0.05, help="Seconds per fake Telegram API call")
+    parser.add_argument("--download-delay", type=float, default=0.1, help="Seconds per fake voice download")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[2, 6, 20, 60], help="Fixture lengths in seconds")
+    parser.add_argument("--variants", type=int, default=3, help="Different recordings per length")
+    parser.add_argument("--drain-timeout", type=float, default=60, help="Max seconds to wait for queued sends")
+    parser.add_argument("--chat-limits", action="store_true",
+                        help="Keep Telegram's per-chat limits (1/s per user, 20/min per group) in every phase, "
+                             "not just moderate")
+    parser.add_argument("--mongo", help="Scratch MongoDB URI instead of mongomock")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logging")
+    args = parser.parse_args()
+
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+    # Swap the network clients before bot.py imports them
+    import telethon
+    telethon.TelegramClient = FakeClient
+    FakeClient.rtt = args.rtt
+    if args.mongo:
+        os.environ["MONGO_URI"] = args.mongo
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required without --mongo: pip install mongomock")
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    if not args.verbose:
+        # Per-event warnings (flagged duplicates, busy analyzer) would bury the report
+        logging.getLogger().setLevel(logging.ERROR)
+        logger.setLevel(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
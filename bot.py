@@ -2,20 +2,33 @@
 # Voice verification bot for Tamil Novels group
 # Fixed for Telethon v1.24+ | No ChatJoinRequest needed
 
-import os, io, asyncio, logging
-from datetime import datetime, timezone
+import math, time, asyncio, logging, signal
+from datetime import datetime, timedelta, timezone
 from telethon import TelegramClient, events, errors
 from telethon.tl import types
 from telethon.tl.custom import Button
 from pymongo import MongoClient
-
-# Optional: pydub for voice analysis
-try:
-    from pydub import AudioSegment
-    HAS_AUDIO = True
-except ImportError:
-    HAS_AUDIO = False
-    print("Warning: pydub not found. Voice analysis disabled.")
+from config import Config
+from storage import FINISHED, OPEN, Conflict, PendingStore
+from cache import MISSING, TTLCache
+from fingerprints import FingerprintIndex
+from jobs import RemoteAnalyzer, VoiceJobs
+from joins import JoinStorm
+from metrics import (
+    FLOOD_WAITS, HANDLER_LATENCY, REGISTRY, STAGE_LATENCY, THROTTLED, TRANSITIONS, VOICE_REJECTIONS,
+    Gauge, serve as serve_metrics, timed_handler,
+)
+from modlog import ModlogBatcher
+from outbox import Lane, Outbox
+from ratelimit import UserLimiter
+from reconcile import Reconciler
+from scheduler import ReminderScheduler, as_utc, parse_duration
+from startup import Startup
+from voice import HAS_AUDIO, AnalyzerBusy, VoiceAnalyzer, precheck_voice
+
+# Optional: ffmpeg for voice analysis (not needed here when worker.py decodes)
+if not HAS_AUDIO and Config.VOICE_BACKEND != "queue":
+    print("Warning: ffmpeg not found. Voice analysis disabled.")
 
 # ---------------- Logging ----------------
 logging.basicConfig(
@@ -24,34 +37,39 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# ---------------- Config ----------------
-class Config:
-    API_ID = int(os.getenv("API_ID"))
-    API_HASH = os.getenv("API_HASH")
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    MONGO_URI = os.getenv("MONGO_URI")
-    GROUP_ID = int(os.getenv("GROUP_ID"))  # -100...
-    TOPIC_ID = int(os.getenv("TOPIC_ID", "0")) # Default to 0 if not set
-    MODLOG_CHAT = int(os.getenv("MODLOG_CHAT"))
-    ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip()]
-    TIMEOUT = int(os.getenv("TIMEOUT", "7200"))  # 2 hours
+# Telegram first; Mongo and the audio pipeline come up in the background (see start_bot)
+startup = Startup(required=("telegram", "mongo"))
 
 # ---------------- Database ----------------
-try:
-    mongo = MongoClient(Config.MONGO_URI)
-    # Ping the server to ensure connection is active
-    mongo.admin.command('ping')
-    logger.info("✅ Connected to MongoDB")
+# Nothing here touches the network. The client is created by start_bot under
+# retry (open_database): with a mongodb+srv:// URI pymongo resolves DNS in the
+# MongoClient constructor, so a Mongo or DNS outage delays readiness instead
+# of crashing the process. The repositories get their collections then.
+mongo = db = None
+store = PendingStore(
+    None, max_workers=Config.DB_WORKERS,
+    cache=TTLCache(maxsize=Config.STATE_CACHE_SIZE, ttl=Config.STATE_CACHE_TTL)
+)
+fingerprints = FingerprintIndex(
+    None, store.executor,
+    maxsize=Config.FINGERPRINT_INDEX_SIZE, max_distance=Config.FINGERPRINT_MAX_DISTANCE
+)
+
+def open_database():
+    """Create the client and hand each repository its collection (blocking: run on a DB thread)."""
+    global mongo, db
+    client = MongoClient(Config.MONGO_URI, serverSelectionTimeoutMS=5000)
     # Use your existing database (replace 'telegram_bot' if different)
-    db = mongo.telegram_bot
-    pending = db.pending_applications  # Collection name
-    logger.info("✅ Database and collection ready")
-except Exception as e:
-    logger.error(f"❌ Failed to connect to MongoDB: {e}")
-    exit(1) # Exit if DB connection fails
+    db = client.telegram_bot
+    store.col = db.pending_applications  # Collection name
+    fingerprints.col = db.voice_fingerprints
+    if voice_jobs is not None:
+        voice_jobs.col = db.voice_jobs
+    mongo = client
 
 # ---------------- Bot Client ----------------
 bot = TelegramClient('guard_bot', Config.API_ID, Config.API_HASH)
+outbox = Outbox(workers=Config.OUTBOX_WORKERS, global_rate=Config.SEND_RATE)
 
 # ---------------- Messages ----------------
 START_MSG = (
@@ -95,156 +113,314 @@ def esc(s):
         s = s.replace(c, f'\\{c}')
     return s
 
-async def log_mod(text):
+# All outgoing messages go through the outbox (priority lanes, rate limits, FloodWait retry)
+async def send(lane, chat_id, *args, peer=None, **kwargs):
+    """`peer` (an input entity for chat_id) saves Telethon a lookup."""
+    return await outbox.send(lane, chat_id, lambda: bot.send_message(peer or chat_id, *args, **kwargs))
+
+async def reply(event, *args, **kwargs):
+    return await outbox.send(Lane.REPLY, event.chat_id, lambda: event.reply(*args, **kwargs))
+
+async def edit(event, *args, **kwargs):
+    # Editing the bot's own message isn't a new message: no per-chat bucket
+    return await outbox.send(Lane.ADMIN, None, lambda: event.edit(*args, **kwargs))
+
+async def send_modlog(text):
     try:
-        await bot.send_message(Config.MODLOG_CHAT, text, parse_mode='markdown')
+        await send(Lane.MODLOG, Config.MODLOG_CHAT, text, parse_mode='markdown')
         logger.info("✅ Logged to MODLOG_CHAT")
     except Exception as e:
         logger.warning(f"⚠️ Failed to log to MODLOG_CHAT: {e}")
 
+modlog = ModlogBatcher(send_modlog, window=Config.MODLOG_BATCH_WINDOW, max_entries=Config.MODLOG_BATCH_SIZE)
+
+async def log_mod(text):
+    """Informational modlog line; batched unless MODLOG_BATCH_WINDOW is 0."""
+    if Config.MODLOG_BATCH_WINDOW > 0:
+        modlog.add(text)
+    else:
+        await send_modlog(text)
+
+# ---------------- Entity Cache ----------------
+# user_id → access_hash for every user seen joining or messaging the bot, so
+# admin callbacks can address users without a network resolve.
+entities = TTLCache(maxsize=Config.ENTITY_CACHE_SIZE, ttl=7 * 24 * 3600)
+
+def remember_user(user):
+    if user and getattr(user, "access_hash", None) is not None:
+        entities.set(user.id, user.access_hash)
+
+async def input_user(user_id, record=None):
+    """InputPeerUser from the local cache or stored record; network lookup only on a miss."""
+    access_hash = entities.get(user_id)
+    if access_hash is MISSING and record and record.get("access_hash") is not None:
+        access_hash = record["access_hash"]
+        entities.set(user_id, access_hash)
+    if access_hash is not MISSING:
+        return types.InputPeerUser(user_id, access_hash)
+    logger.info(f"🌐 Entity cache miss for {user_id}, resolving via Telegram")
+    peer = await bot.get_input_entity(user_id)
+    entities.set(user_id, peer.access_hash)
+    return peer
+
 # ---------------- Voice Analysis ----------------
-def is_valid_voice(audio_data):
-    if not HAS_AUDIO:
-        logger.info("ℹ️ Skipping voice analysis (pydub not available)")
-        return True # Accept if analysis is disabled
+# VOICE_BACKEND=queue: worker.py processes decode, this process only keeps the Telegram connection
+voice_jobs = None
+if Config.VOICE_BACKEND == "queue":
+    voice_jobs = VoiceJobs(None, store.executor, lease=Config.VOICE_JOB_TIMEOUT)  # Collection set by open_database
+    analyzer = RemoteAnalyzer(voice_jobs, max_queue=Config.VOICE_QUEUE_LIMIT, timeout=Config.VOICE_JOB_TIMEOUT)
+elif HAS_AUDIO:
+    analyzer = VoiceAnalyzer(workers=Config.VOICE_WORKERS, max_queue=Config.VOICE_QUEUE_LIMIT)
+else:
+    analyzer = None
+
+async def is_valid_voice(audio_data):
+    """Decode in the process pool and return (is_valid, VoiceStats or None).
+
+    Raises AnalyzerBusy when the queue is full.
+    """
+    if analyzer is None:
+        logger.info("ℹ️ Skipping voice analysis (ffmpeg not available)")
+        return True, None # Accept if analysis is disabled
+    start = time.perf_counter()
     try:
-        audio = AudioSegment.from_file(io.BytesIO(audio_data), format="ogg")
-        duration_ms = len(audio)
-        loudness = audio.dBFS
+        stats = await analyzer.analyze(audio_data)
+        # Refusals (AnalyzerBusy) return at once and are counted as rejections, not timed
+        STAGE_LATENCY.observe(time.perf_counter() - start, stage="decode", op=Config.VOICE_BACKEND)
+        duration_ms, loudness = stats.duration_ms, stats.dbfs
         logger.debug(f"🔊 Voice note analysis - Duration: {duration_ms}ms, Loudness: {loudness}dBFS")
-        too_short = duration_ms < 4000 # Less than 4 seconds
+        too_short = duration_ms < Config.MIN_VOICE_SECONDS * 1000
         too_quiet = loudness < -50 # Too quiet (dBFS is negative, -50 is quite low)
         is_valid = not (too_short or too_quiet)
         if not is_valid:
             logger.info(f"❌ Voice note rejected - Too short: {too_short}, Too quiet: {too_quiet}")
-        return is_valid
+            VOICE_REJECTIONS.inc(reason="too_short" if too_short else "too_quiet")
+        return is_valid, stats
+    except AnalyzerBusy:
+        VOICE_REJECTIONS.inc(reason="busy")
+        raise
     except Exception as e:
         logger.warning(f"⚠️ Audio analysis failed: {e}. Treating as invalid.")
-        return False # Reject on analysis error
+        VOICE_REJECTIONS.inc(reason="analysis_error")
+        return False, None # Reject on analysis error
+
+# ---------------- Metrics ----------------
+REGISTRY.add(Gauge("guard_outbox_depth", "Queued outgoing messages per lane",
+                   lambda: {lane: depth for lane, depth in outbox.stats()["depth"].items()}, "lane"))
+REGISTRY.add(Gauge("guard_state_cache", "Application state cache counters",
+                   lambda: store.cache.stats(), "stat"))
+REGISTRY.add(Gauge("guard_entity_cache", "Entity (access hash) cache counters",
+                   lambda: entities.stats(), "stat"))
+REGISTRY.add(Gauge("guard_voice_inflight", "Voice notes being analysed or queued",
+                   lambda: analyzer.inflight if analyzer else 0))
+REGISTRY.add(Gauge("guard_startup_seconds", "Seconds after start until each dependency was ready",
+                   lambda: dict(startup.timings), "step"))
+REGISTRY.add(Gauge("guard_ready", "1 once Telegram and MongoDB are ready", lambda: int(startup.is_ready())))
+
+def metrics_summary():
+    """Short text version of the metrics for the /metrics admin command."""
+    def ms(value):
+        return "–" if value is None else ("∞" if value == float("inf") else f"≤{value * 1000:g}ms")
+
+    lines = ["📈 **Handlers** (count, p50, p99)"]
+    for (handler,), _ in sorted(HANDLER_LATENCY.series.items()):
+        lines.append(f"`{handler}` {HANDLER_LATENCY.count(handler=handler)}, "
+                     f"{ms(HANDLER_LATENCY.quantile(0.5, handler=handler))}, {ms(HANDLER_LATENCY.quantile(0.99, handler=handler))}")
+    lines.append("⏱️ **Stages** (count, p50, p99)")
+    for (stage, op), _ in sorted(STAGE_LATENCY.series.items()):
+        lines.append(f"`{stage}/{op}` {STAGE_LATENCY.count(stage=stage, op=op)}, "
+                     f"{ms(STAGE_LATENCY.quantile(0.5, stage=stage, op=op))}, {ms(STAGE_LATENCY.quantile(0.99, stage=stage, op=op))}")
+    for title, counter in (("🔄 **Transitions**", TRANSITIONS), ("❌ **Voice rejections**", VOICE_REJECTIONS),
+                           ("🌊 **FloodWaits**", FLOOD_WAITS)):
+        values = ", ".join(f"{key[0]}: {value}" for key, value in sorted(counter.values.items()))
+        lines.append(f"{title}: {values or 'none'}")
+    if store and store.cache is not None:
+        cache = store.cache.stats()
+        lines.append(f"🗃️ **State cache**: {cache['size']} entries, {cache['hits']} hits, {cache['misses']} misses, {cache['evictions']} evictions")
+    return "\n".join(lines)
 
 # ---------------- Handlers ----------------
 async def start_bot():
-    await bot.start(bot_token=Config.BOT_TOKEN)
-    logger.info("🛡️ Bot started. Registering handlers...")
+    startup.mark("init")
+    # Probes answer from the first moment, before any dependency is up
+    if Config.METRICS_PORT:
+        try:
+            await serve_metrics(Config.METRICS_HOST, Config.METRICS_PORT, routes={
+                "/healthz": lambda: (200, "ok\n"),
+                "/readyz": lambda: startup.readiness({"telegram_connection": bot.is_connected()}),
+            })
+        except OSError as e:
+            logger.warning(f"⚠️ Could not start metrics endpoint: {e}")
+    # Handlers are registered before connecting, so early updates wait at their gate
+    logger.info("🛡️ Registering handlers...")
 
     # --- Centralized Join Processing Function ---
-    async def process_new_member(user):
-        """Common processing for new members joining the group."""
-        if not user:
-            logger.warning("⚠️ process_new_member called with None user.")
+    async def send_welcome(user):
+        logger.info(f"📤 Sending WELCOME_MSG to {user.id}")
+        await send(Lane.WELCOME, user.id, WELCOME_MSG.format(name=esc(user.first_name)))
+        logger.info(f"✅ Sent welcome DM to {user.id}")
+
+    async def welcome_new_member(user):
+        """Welcome DM with per-user modlog reporting of failures."""
+        try:
+            await send_welcome(user)
+        except errors.UserIsBlockedError:
+            logger.warning(f"🚫 User {user.id} has blocked the bot. Cannot send welcome message.")
+            await log_mod(f"⚠️ DM failed for {user.id} ({user.first_name}): User blocked the bot.")
+        except errors.InputUserDeactivatedError:
+            logger.warning(f"💀 User {user.id} account is deactivated.")
+            await log_mod(f"⚠️ DM failed for {user.id} ({user.first_name}): User account deactivated.")
+        except Exception as e:
+            error_msg = f"❌ Failed to DM {user.id} ({user.first_name}): {type(e).__name__}: {e}"
+            logger.error(error_msg)
+            await log_mod(error_msg)
+
+    storm = JoinStorm(Config.JOIN_STORM_THRESHOLD, send_welcome, log_mod)
+    REGISTRY.add(Gauge("guard_join_storm_active", "1 while join-storm mode is on", lambda: int(storm.active)))
+    join_slots = asyncio.Semaphore(Config.JOIN_CONCURRENCY)
+
+    async def process_new_members(users, reconciled=False):
+        """Common processing for new members joining the group (one or many per event).
+
+        `reconciled` users come from the startup sweep, which paces itself,
+        so they don't count towards join-storm detection.
+        """
+        users = [u for u in users if u]
+        if not users:
+            logger.warning("⚠️ process_new_members called without users.")
             return
 
-        logger.info(f"📥 Processing new member: {user.id} ({user.first_name})")
+        logger.info(f"📥 Processing {len(users)} new member(s): {[u.id for u in users]}")
+        for user in users:
+            remember_user(user)
 
         # --- State Transition Logic ---
-        # Check if the user already has a record (started, pending, etc.)
-        existing_record = pending.find_one({"user_id": user.id})
-        logger.debug(f"  Existing DB record for {user.id}: {existing_record}")
-
-        # Prepare data to update/set in the database
-        update_data = {
-            "first_name": user.first_name,
-            "username": user.username,
-            "request_time": datetime.now(timezone.utc),
-            "status": "pending"  # *** CRITICAL: Set status to 'pending' upon join ***
-        }
-        logger.info(f"💾 Updating/Creating record for {user.id} with status 'pending'. Data: {update_data}")
-
-        # Update or create the database record
-        result = pending.update_one(
-            {"user_id": user.id}, # Find by user ID
-            {"$set": update_data}, # Set all fields
-            upsert=True # Create if it doesn't exist
-        )
-        logger.info(f"✅ Database record for {user.id} updated/created. Matched: {result.matched_count}, Modified: {result.modified_count}, Upserted: {result.upserted_id is not None}")
+        # Set status to 'pending' and get back the previous records:
+        # one atomic upsert for a single user, one $in read + one bulk_write for many
+        due_at = datetime.now(timezone.utc) + timedelta(seconds=Config.TIMEOUT)
+        if len(users) == 1:
+            previous = {users[0].id: await store.mark_pending(users[0], due_at=due_at)}
+        else:
+            previous = await store.mark_pending_many(users, due_at=due_at)
+        scheduler.notify(due_at)
 
-        # --- Send Welcome Message and Start Reminder ---
-        # Only send welcome/reminder if this is a new join (status transitioned to pending)
+        # --- Send Welcome Messages ---
+        # Only welcome users whose status transitioned to pending
         # This prevents spamming if the user joins multiple times or events fire repeatedly
-        # We can check if a new document was upserted or if the status changed from non-pending
-        if result.upserted_id or (existing_record and existing_record.get("status") != "pending"):
-             try:
-                logger.info(f"📤 Sending WELCOME_MSG to {user.id}")
-                await bot.send_message(user.id, WELCOME_MSG.format(name=esc(user.first_name)))
-                logger.info(f"✅ Sent welcome DM to {user.id}")
-                # Start reminder task
-                asyncio.create_task(reminder_task(user.id, user.first_name))
-                logger.info(f"⏱️ Started reminder task for {user.id}")
-             except errors.UserIsBlockedError:
-                logger.warning(f"🚫 User {user.id} has blocked the bot. Cannot send welcome message.")
-                await log_mod(f"⚠️ DM failed for {user.id} ({user.first_name}): User blocked the bot.")
-             except errors.InputUserDeactivatedError:
-                logger.warning(f"💀 User {user.id} account is deactivated.")
-                await log_mod(f"⚠️ DM failed for {user.id} ({user.first_name}): User account deactivated.")
-             except Exception as e:
-                error_msg = f"❌ Failed to DM {user.id} ({user.first_name}): {type(e).__name__}: {e}"
-                logger.error(error_msg)
-                await log_mod(error_msg)
-        else:
-             logger.info(f"ℹ️ Skipping welcome/reminder for {user.id} (likely already pending or record existed).")
+        fresh = []
+        for user in users:
+            record = previous[user.id]
+            if record is None or record.get("status") != "pending":
+                fresh.append(user)
+            else:
+                logger.info(f"ℹ️ Skipping welcome for {user.id} (already pending).")
+        logger.info(f"✅ Database records updated/created for {len(users)} user(s), {len(fresh)} newly pending")
 
-    # Handle voice notes in DM
-    @bot.on(events.NewMessage(incoming=True, func=lambda e: e.is_private and e.voice))
-    async def voice_handler(event):
-        user = await event.get_sender()
-        if not user:
-            logger.warning("❌ Could not get sender from voice message")
+        if not reconciled and storm.record(len(users)):
+            # Join storm: collapse and pace welcomes, failures are summarised later
+            for user in fresh:
+                storm.enqueue(user)
             return
 
-        logger.info(f"🎤 Received voice note from user {user.id} ({user.first_name})")
+        async def bounded_welcome(user):
+            async with join_slots:
+                await welcome_new_member(user)
+        await asyncio.gather(*(bounded_welcome(u) for u in fresh))
+
+    async def process_new_member(user):
+        await process_new_members([user])
+
+    # --- Duplicate voice notes (same file or same recording from another user) ---
+    async def duplicate_blocks(event, user, match, kind):
+        """Report a duplicate; True if the note must stop here (DUPLICATE_ACTION=reject)."""
+        detail = f"{kind}, distance {match.distance}" if match.distance else kind
+        note = f"🔁 Duplicate voice ({detail}) from `{user.id}` — {esc(user.first_name)}, first sent by `{match.user_id}`"
+        logger.warning(note)
+        if Config.DUPLICATE_ACTION != "reject":
+            return False
+        VOICE_REJECTIONS.inc(reason="duplicate_file" if kind == "same file" else "duplicate_audio")
+        await reply(event, "❌ இந்த குரல் பதிவு ஏற்கனவே வேறு ஒருவரால் அனுப்பப்பட்டது. உங்கள் சொந்த குரலில் புதிய பதிவை அனுப்பவும்.")
+        await log_mod(note)
+        return True
+
+    async def check_voice(event, user):
+        """Claim, download, analyse and forward one voice note (caller holds the user's lease)."""
         # --- Enhanced Logic: Accept 'started' or 'pending' ---
         # This provides robustness in case the join event is slightly delayed or missed
         # but the user has initiated the process.
         logger.info(f"🔍 Checking for application record (started/pending) for user {user.id}")
-        # Find record where status is either 'started' or 'pending'
-        record = pending.find_one({
-            "user_id": user.id,
-            "status": {"$in": ["started", "pending"]} # Accept both statuses
-        })
+        # Atomically move 'started' or 'pending' to 'pending' and get the previous record
+        record = await store.claim_for_voice(user.id)
 
         if not record:
             logger.warning(f"❌ No application record (started/pending) found for {user.id} ({user.first_name})")
-            await event.reply("❌ உங்கள் விண்ணப்பம் காணப்படவில்லை. முதலில் குழுவில் சேர விண்ணப்பிக்கவும்.")
+            VOICE_REJECTIONS.inc(reason="no_application")
+            await reply(event, "❌ உங்கள் விண்ணப்பம் காணப்படவில்லை. முதலில் குழுவில் சேர விண்ணப்பிக்கவும்.")
             return
 
-        # If a record exists, ensure its status is 'pending' before proceeding
         # This handles the case where status was 'started' and we are accepting it.
         if record.get("status") != "pending":
-            logger.info(f"🔄 Updating status for {user.id} from '{record.get('status')}' to 'pending' upon voice receipt.")
-            pending.update_one({"user_id": user.id}, {"$set": {"status": "pending"}})
+            logger.info(f"🔄 Updated status for {user.id} from '{record.get('status')}' to 'pending' upon voice receipt.")
             record["status"] = "pending" # Update local record for logging
 
         logger.info(f"🔄 User {user.id} state: {record['status']} → voice_sent (processing voice)")
 
+        # --- Duplicate check 1: same Telegram file (forwarded note), before downloading ---
+        check_duplicates = Config.DUPLICATE_ACTION != "off"
+        file_id = event.document.id if event.document else None
+        duplicate_of = fingerprints.match_file(file_id, user.id) if check_duplicates and file_id else None
+        if duplicate_of and await duplicate_blocks(event, user, duplicate_of, "same file"):
+            return
+
         try:
             logger.info(f"📥 Downloading voice note from {user.id}")
-            voice_data = await event.download_media(bytes)
+            with STAGE_LATENCY.time(stage="download", op="voice"):
+                voice_data = await event.download_media(bytes)
             logger.info(f"✅ Voice note downloaded for {user.id}")
         except Exception as e:
             logger.error(f"❌ Failed to download voice for {user.id}: {e}")
-            await event.reply("❌ குரல் பதிவை பதிவிறக்க முடியவில்லை. மீண்டும் முயற்சிக்கவும்.")
+            VOICE_REJECTIONS.inc(reason="download_failed")
+            await reply(event, "❌ குரல் பதிவை பதிவிறக்க முடியவில்லை. மீண்டும் முயற்சிக்கவும்.")
             return
 
-        if not is_valid_voice(voice_data):
-            await event.reply("❌ குரல் பதிவு மிகக் குறுகியது அல்லது தெளிவற்றது. மீண்டும் அனுப்பவும்.")
+        try:
+            valid, stats = await is_valid_voice(voice_data)
+        except AnalyzerBusy as e:
+            logger.warning(f"⏳ Voice analysis busy, asking {user.id} to retry: {e}")
+            await reply(event, "⏳ தற்போது பல குரல் பதிவுகள் சரிபார்க்கப்படுகின்றன. சிறிது நேரத்தில் மீண்டும் அனுப்பவும்.")
+            return
+
+        if not valid:
+            await reply(event, "❌ குரல் பதிவு மிகக் குறுகியது அல்லது தெளிவற்றது. மீண்டும் அனுப்பவும்.")
             return
 
+        # --- Duplicate check 2: near-identical audio fingerprint (same decode pass) ---
+        if check_duplicates and stats and file_id:
+            if not duplicate_of:
+                duplicate_of = fingerprints.match_audio(stats.fingerprint, stats.duration_ms, user.id, stats.fingerprint_bits)
+                if duplicate_of and await duplicate_blocks(event, user, duplicate_of, "same audio"):
+                    return
+            try:
+                await fingerprints.add(file_id, stats.fingerprint, stats.duration_ms, user.id, stats.fingerprint_bits)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to store voice fingerprint for {user.id}: {e}")
+
         try:
             logger.info(f"📤 Forwarding voice note from {user.id} to MODLOG_CHAT")
-            msg = await event.forward_to(Config.MODLOG_CHAT)
-            await event.reply("✅ குரல் பதிவு பெறப்பட்டது. நிர்வாகி விரைவில் பதிலளிப்பார்.")
+            msg = await outbox.send(Lane.REPLY, Config.MODLOG_CHAT, lambda: event.forward_to(Config.MODLOG_CHAT))
+            await reply(event, "✅ குரல் பதிவு பெறப்பட்டது. நிர்வாகி விரைவில் பதிலளிப்பார்.")
 
             # Update database status and store message ID
-            pending.update_one(
-                {"user_id": user.id},
-                {"$set": {"status": "voice_sent", "msg_id": msg.id}}
-            )
+            if not await store.set_status(user.id, "voice_sent", from_statuses=["pending"], msg_id=msg.id):
+                logger.warning(f"⚠️ Application of {user.id} left 'pending' while its voice note was checked")
+                return
             logger.info(f"💾 Updated database for {user.id} to 'voice_sent'")
 
             # Notify mod group with approve/reject buttons
-            await bot.send_message(
-                Config.MODLOG_CHAT,
-                f"🎤 செல்லுபடியான குரல் பதிவு from [{esc(user.first_name)}](tg://user?id={user.id}) (`{user.id}`)",
+            await send(
+                Lane.REPLY, Config.MODLOG_CHAT,
+                f"🎤 செல்லுபடியான குரல் பதிவு from [{esc(user.first_name)}](tg://user?id={user.id}) (`{user.id}`)"
+                + (f"\n⚠️ Possible duplicate of `{duplicate_of.user_id}`'s voice note" if duplicate_of else ""),
                 buttons=[
                     [Button.inline("✅ Approve", data=f"approve_{user.id}"),
                      Button.inline("❌ Reject", data=f"reject_{user.id}")]
@@ -257,8 +433,46 @@ async def start_bot():
             logger.error(error_msg)
             await log_mod(error_msg)
 
+    # Handle voice notes in DM (routed by private_router)
+    @timed_handler("voice_handler")
+    async def voice_handler(event, user, record):
+        logger.info(f"🎤 Received voice note from user {user.id} ({user.first_name})")
+
+        # --- Metadata fast path: reject on duration/size before downloading anything ---
+        reason = precheck_voice(
+            event.file.duration if event.file else None,
+            event.file.size if event.file else None,
+            Config.MIN_VOICE_SECONDS, Config.MAX_VOICE_SECONDS, Config.MAX_VOICE_BYTES
+        )
+        if reason:
+            logger.info(f"❌ Voice note from {user.id} rejected before download: {reason}")
+            VOICE_REJECTIONS.inc(reason=reason)
+            if reason == "too_short":
+                await reply(event, "❌ குரல் பதிவு மிகக் குறுகியது அல்லது தெளிவற்றது. மீண்டும் அனுப்பவும்.")
+            else:
+                await reply(event, f"❌ குரல் பதிவு மிக நீளமானது. {Config.MAX_VOICE_SECONDS} வினாடிகளுக்குள் ஒரு பதிவை அனுப்பவும்.")
+            return
+
+        # Cached state says there is nothing to claim: answer without touching Mongo
+        if not record or record.get("status") not in ("started", "pending"):
+            logger.warning(f"❌ No application record (started/pending) found for {user.id} ({user.first_name})")
+            VOICE_REJECTIONS.inc(reason="no_application")
+            await reply(event, "❌ உங்கள் விண்ணப்பம் காணப்படவில்லை. முதலில் குழுவில் சேர விண்ணப்பிக்கவும்.")
+            return
+
+        # One note per user at a time, across handlers and bot processes
+        try:
+            async with store.lease(user.id, Config.LEASE_SECONDS):
+                await check_voice(event, user)
+        except Conflict:
+            logger.info(f"⏳ Voice note from {user.id} arrived while another is being checked")
+            VOICE_REJECTIONS.inc(reason="in_progress")
+            await reply(event, "⏳ உங்கள் முந்தைய குரல் பதிவு சரிபார்க்கப்படுகிறது. சிறிது நேரம் காத்திருக்கவும்.")
+
     # --- Improved ChatAction Handler ---
     @bot.on(events.ChatAction)
+    @startup.gated("mongo")
+    @timed_handler("chat_action_handler")
     async def chat_action_handler(event):
         # Only proceed if it's our target group
         if event.chat_id != Config.GROUP_ID:
@@ -287,20 +501,52 @@ async def start_bot():
             users = event.users if event.users else [await event.get_user()] if event.user else []
             logger.info(f"👥 Users involved in join/add: {[u.id for u in users if u]}")
 
-            for user in users:
-                if user:
-                    logger.info(f"👤 Processing standard join/add for user: {user.id} ({user.first_name})")
-                    await process_new_member(user)
-                else:
-                    logger.warning("⚠️ Encountered None user in standard join/add event.")
+            if not all(users):
+                logger.warning("⚠️ Encountered None user in standard join/add event.")
+            await process_new_members(users)
             return # Exit after handling standard joins/adds
 
         # 3. Log other ChatAction events for potential future debugging
         logger.debug(f"🔍 Other ChatAction event (not join/add/link): {event}")
         # --- End Enhanced Join Detection ---
 
+    # --- Telegram side of a moderation decision (shared by buttons and bulk commands) ---
+    # Decisions are recorded first (status CAS under the user's lease), so a second
+    # click or a bulk run sees them at once; the Telegram side follows outside the lease.
+    async def deliver_approval(user_id, peer, name, previous, lane=Lane.ADMIN):
+        """Grant access and send the approval DM; returns whether the DM went out.
+
+        If access can't be granted the approval is undone (back to `previous`,
+        so it can be approved again) and the error raised.
+        """
+        try:
+            # Grant view_messages permission (assuming default restrictions)
+            # Not a message: kept out of the user's 1/s bucket, which the DM below needs
+            await outbox.send(lane, None, lambda: bot.edit_permissions(Config.GROUP_ID, peer, view_messages=True))
+        except Exception:
+            await store.set_status(user_id, previous, from_statuses=["approved"])
+            raise
+        group_id_part = str(Config.GROUP_ID)[4:] # Remove -100 prefix for link
+        try:
+            await send(
+                lane, user_id,
+                APPROVED_MSG.format(
+                    name=esc(name),
+                    group_id_part=group_id_part,
+                    topic_id=Config.TOPIC_ID
+                ),
+                peer=peer
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ Approved {user_id}, but the approval DM failed: {e}")
+            await log_mod(f"⚠️ Approval DM to `{user_id}` failed: {type(e).__name__}")
+            return False
+
     # Approval/Rejection callback
     @bot.on(events.CallbackQuery(pattern=r"^(approve|reject)_(\d+)$"))
+    @startup.gated("mongo")
+    @timed_handler("approve_handler")
     async def approve_handler(event):
         if event.sender_id not in Config.ADMINS:
             await event.answer("🚫 உங்களுக்கு அனுமதி இல்லை.", alert=True)
@@ -309,87 +555,98 @@ async def start_bot():
         action, user_id_str = event.data.decode().split("_")
         user_id = int(user_id_str)
         logger.info(f"🖱️ Admin {event.sender_id} clicked {action} for user {user_id}")
+        # Double clicks, two admins or two bot processes: only one decision is recorded
         try:
-            user = await bot.get_entity(user_id)
+            async with store.lease(user_id, Config.LEASE_SECONDS) as record:
+                decided = await decide(event, action, user_id, record)
+                if decided:
+                    # Answered as soon as the decision is recorded, before the release and any paced send
+                    await event.answer("✅ Approved!" if action == "approve" else "❌ Rejected!", alert=True)
+        except Conflict:
+            logger.info(f"⏳ {action} for {user_id} ignored, another decision is in progress")
+            await event.answer("⏳ Another admin is handling this application.", alert=True)
+            return
+        if decided:
+            await deliver_decision(event, action, user_id, *decided)
+
+    async def decide(event, action, user_id, record):
+        """Record the decision (caller holds the lease; `record` is fresh from Mongo).
+
+        Returns (peer, name, previous status), or None once the admin has been answered.
+        """
+        if record is None:
+            logger.warning(f"❌ {action} for {user_id}: no application record")
+            await event.answer("❌ Application not found", alert=True)
+            return None
+        if record.get("status") in FINISHED:
+            logger.info(f"ℹ️ {action} for {user_id} ignored, already {record['status']}")
+            await event.answer(f"ℹ️ Already {record['status']}.", alert=True)
+            return None
+        # Build everything from the stored record + entity cache (no get_entity per click)
+        try:
+            peer = await input_user(user_id, record)
         except Exception as e:
             logger.error(f"❌ Failed to get user {user_id}: {e}")
             await event.answer("❌ User not found", alert=True)
-            return
-
+            return None
+        status = "approved" if action == "approve" else "rejected"
+        if not await store.set_status(user_id, status, from_statuses=OPEN):
+            logger.info(f"ℹ️ {action} for {user_id} ignored, application closed meanwhile")
+            await event.answer("ℹ️ This application is no longer open.", alert=True)
+            return None
+        return peer, record.get("first_name"), record["status"]
+
+    async def deliver_decision(event, action, user_id, peer, name, previous):
+        """Telegram side of a recorded decision (the admin has been answered already).
+
+        Failures are reported by editing the button message.
+        """
         if action == "approve":
             try:
-                logger.info(f"✅ Approving user {user.id}")
-                # Grant view_messages permission (assuming default restrictions)
-                await bot.edit_permissions(Config.GROUP_ID, user_id, view_messages=True)
-                group_id_part = str(Config.GROUP_ID)[4:] # Remove -100 prefix for link
-                await bot.send_message(
-                    user_id,
-                    APPROVED_MSG.format(
-                        name=esc(user.first_name),
-                        group_id_part=group_id_part,
-                        topic_id=Config.TOPIC_ID
-                    )
-                )
-                pending.update_one({"user_id": user_id}, {"$set": {"status": "approved"}})
-                await event.edit(f"✅ Approved user {user.first_name} (`{user.id}`)")
-                await log_mod(f"✅ Approved `{user.id}` — {esc(user.first_name)}")
-                await event.answer("✅ Approved!", alert=True)
+                logger.info(f"✅ Approving user {user_id}")
+                dm_sent = await deliver_approval(user_id, peer, name, previous)
+                await edit(event, f"✅ Approved user {name} (`{user_id}`)" + ("" if dm_sent else " — ⚠️ DM failed"))
+                await log_mod(f"✅ Approved `{user_id}` — {esc(name)}")
             except Exception as e:
-                error_msg = f"❌ Approval failed for {user.id}: {e}"
+                error_msg = f"❌ Approval failed for {user_id}: {e}"
                 logger.error(error_msg)
-                await event.edit(error_msg)
-                await event.answer("❌ Approval failed", alert=True)
+                await edit(event, error_msg)
         else: # Reject
             try:
-                logger.info(f"❌ Rejecting user {user.id}")
-                await bot.send_message(user_id, REJECTED_MSG)
-                pending.update_one({"user_id": user_id}, {"$set": {"status": "rejected"}})
-                await event.edit(f"❌ Rejected user {user.first_name} (`{user.id}`)")
-                await log_mod(f"❌ Rejected `{user.id}` — {esc(user.first_name)}")
-                await event.answer("❌ Rejected!", alert=True)
+                logger.info(f"❌ Rejecting user {user_id}")
+                await send(Lane.ADMIN, user_id, REJECTED_MSG, peer=peer)
+                await edit(event, f"❌ Rejected user {name} (`{user_id}`)")
+                await log_mod(f"❌ Rejected `{user_id}` — {esc(name)}")
             except Exception as e:
-                error_msg = f"❌ Rejection failed for {user.id}: {e}"
+                # The rejection is recorded; only telling the user failed
+                error_msg = f"⚠️ Rejected {user_id}, but the DM failed: {e}"
                 logger.error(error_msg)
-                await event.edit(error_msg)
-                await event.answer("❌ Rejection failed", alert=True)
+                await edit(event, error_msg)
 
-    # Start command
-    @bot.on(events.NewMessage(pattern='/start'))
+    # Start command (private /start is routed by private_router)
     async def start(event):
-        if event.is_private:
-            logger.info(f"🚀 /start command received from {event.sender_id}")
-            await event.reply(
-                START_MSG,
-                buttons=[[Button.url("🔗 குழுவில் சேரவும்", "https://t.me/+_1n657JUXHIzODk1")]]
-            )
-        # Delete the /start message in group chats (if accidentally sent there)
-        if not event.is_private:
-             await event.delete()
+        logger.info(f"🚀 /start command received from {event.sender_id}")
+        await reply(event,
+            START_MSG,
+            buttons=[[Button.url("🔗 குழுவில் சேரவும்", "https://t.me/+_1n657JUXHIzODk1")]]
+        )
+
+    # Delete the /start message in group chats (if accidentally sent there)
+    @bot.on(events.NewMessage(pattern='/start', func=lambda e: not e.is_private))
+    async def start_in_group(event):
+        await event.delete()
 
     # Handle "Hi", "Join", etc. (Initial interaction)
-    @bot.on(events.NewMessage(func=lambda e: e.is_private and e.text and e.text.lower().strip() in ['hi', 'hello', 'join', 'start']))
-    async def greet(event):
-        user = await event.get_sender()
-        if not user:
-             return
+    @timed_handler("greet")
+    async def greet(event, user):
         logger.info(f"💬 Greeting trigger received from {user.id}: '{event.text}'")
 
         # Create or update a 'started' record to track initial contact
-        update_data = {
-            "first_name": user.first_name,
-            "username": user.username,
-            "last_interaction": datetime.now(timezone.utc),
-            "status": "started" # Indicate they've started the process
-        }
-        logger.info(f"💾 Updating/creating 'started' record for {user.id} with data: {update_data}")
-        pending.update_one(
-            {"user_id": user.id},
-            {"$set": update_data},
-            upsert=True
-        )
+        logger.info(f"💾 Updating/creating 'started' record for {user.id}")
+        await store.mark_started(user)
         logger.info(f"🔄 User {user.id} state: N/A/other → started")
 
-        await event.reply(
+        await reply(event,
             "✅ நீங்கள் தயாராக உள்ளீர்கள்!\n\n"
             "இப்போது குழுவில் சேர விண்ணப்பிக்கவும்:\n"
             "https://t.me/+_1n657JUXHIzODk1  \n\n"
@@ -397,40 +654,340 @@ async def start_bot():
             buttons=[[Button.url("🔗 குழுவில் சேரவும்", "https://t.me/+_1n657JUXHIzODk1")]]
         )
 
-    # Reminder task
-    async def reminder_task(user_id, name):
-        logger.info(f"⏱️ Starting reminder task for user {user_id}")
-        await asyncio.sleep(Config.TIMEOUT)
-        # Check if the user is still pending
-        record = pending.find_one({"user_id": user_id, "status": "pending"})
-        if record:
+    # Reminder / timeout actions (driven by the scheduler)
+    async def send_reminder(record):
+        user_id, name = record["user_id"], record.get("first_name")
+        try:
+            logger.info(f"⏰ Sending reminder to user {user_id}")
+            await send(Lane.REMINDER, user_id, REMINDER_MSG.format(name=esc(name)))
+            logger.info(f"✅ Reminder sent to {user_id}")
+        except errors.UserIsBlockedError:
+            logger.warning(f"🚫 Reminder failed for {user_id}: User blocked the bot.")
+            await log_mod(f"⚠️ Reminder failed for {user_id} ({name}): User blocked the bot.")
+        except errors.InputUserDeactivatedError:
+            logger.warning(f"💀 Reminder failed for {user_id}: User account deactivated.")
+            await log_mod(f"⚠️ Reminder failed for {user_id} ({name}): User account deactivated.")
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to send reminder to {user_id}: {e}")
+
+    async def expire_application(record):
+        """Telegram side of a timeout; the scheduler already marked it rejected."""
+        user_id, name = record["user_id"], record.get("first_name")
+        logger.info(f"⌛ Application of {user_id} timed out → rejected")
+        if Config.KICK_ON_TIMEOUT:
             try:
-                logger.info(f"⏰ Sending reminder to user {user_id}")
-                await bot.send_message(user_id, REMINDER_MSG.format(name=esc(name)))
-                logger.info(f"✅ Reminder sent to {user_id}")
-            except errors.UserIsBlockedError:
-                logger.warning(f"🚫 Reminder failed for {user_id}: User blocked the bot.")
-                await log_mod(f"⚠️ Reminder failed for {user_id} ({name}): User blocked the bot.")
-            except errors.InputUserDeactivatedError:
-                 logger.warning(f"💀 Reminder failed for {user_id}: User account deactivated.")
-                 await log_mod(f"⚠️ Reminder failed for {user_id} ({name}): User account deactivated.")
+                await bot.kick_participant(Config.GROUP_ID, user_id)
             except Exception as e:
-                logger.warning(f"⚠️ Failed to send reminder to {user_id}: {e}")
+                logger.warning(f"⚠️ Failed to kick {user_id} after timeout: {e}")
+        try:
+            await send(Lane.REMINDER, user_id, REJECTED_MSG)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to send timeout rejection to {user_id}: {e}")
+        await log_mod(f"⌛ Timed out `{user_id}` — {esc(name)}")
+
+    scheduler = ReminderScheduler(
+        store, send_reminder, expire_application,
+        final_timeout=Config.FINAL_TIMEOUT, rate=Config.REMINDER_RATE
+    )
+
+    # --- Reconciliation: joins missed while the bot was offline ---
+    reconciler = Reconciler(
+        # Recent = newest join first (the default search filter has no such order)
+        lambda: bot.iter_participants(Config.GROUP_ID, filter=types.ChannelParticipantsRecent()), store,
+        lambda users: process_new_members(users, reconciled=True),
+        None, store.executor,  # bot_state collection, set once Mongo is connected
+        batch_size=Config.RECONCILE_BATCH, rate=Config.RECONCILE_RATE, lookback=Config.RECONCILE_LOOKBACK
+    )
+
+    def reconcile_summary(stats):
+        if "error" in stats:
+            return f"❌ Reconciliation failed: {stats['error']}"
+        return (f"🔎 Reconciliation since {stats['since']:%Y-%m-%d %H:%M} UTC: {stats['scanned']} members scanned, "
+                f"{stats['recent']} joined since, {stats['missing']} missed join(s) processed ({stats['seconds']}s)")
+
+    async def report_startup_reconcile(stats):
+        if stats.get("missing") or "error" in stats:
+            await log_mod(reconcile_summary(stats))
+
+    @bot.on(events.NewMessage(pattern=r'^/reconcile(@\w+)?(\s+\S+)?$'))
+    @startup.gated("mongo")
+    async def reconcile_command(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        arg = (event.pattern_match.group(2) or "").strip()
+        seconds = parse_duration(arg) if arg else Config.RECONCILE_LOOKBACK
+        if not seconds:
+            await reply(event, "ℹ️ Usage: `/reconcile 6h` (members who joined in the last 6 hours)", parse_mode='markdown')
+            return
+
+        async def report(stats):
+            await reply(event, reconcile_summary(stats))
+
+        since = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        if reconciler.start(since, report):
+            logger.info(f"🔎 Admin {event.sender_id} started reconciliation for the last {seconds}s")
+            await reply(event, "⏳ Reconciling group members...")
         else:
-            logger.info(f"ℹ️ Reminder task for {user_id} cancelled (status not pending or record changed).")
+            await reply(event, "ℹ️ A reconciliation is already running.")
 
     # --- Optional Debug Command ---
-    @bot.on(events.NewMessage(pattern='/status'))
-    async def status_check(event):
-        if event.is_private: # Only respond in private chats
-            user = await event.get_sender()
-            record = pending.find_one({"user_id": user.id})
-            status_msg = f"🔄 Your current application status: `{record.get('status') if record else 'No record found'}`"
-            await event.reply(status_msg, parse_mode='markdown')
-            logger.info(f"ℹ️ /status command used by {user.id}. Response: {status_msg}")
-
+    @timed_handler("status_check")
+    async def status_check(event, user, record):
+        status_msg = f"🔄 Your current application status: `{record.get('status') if record else 'No record found'}`"
+        await reply(event, status_msg, parse_mode='markdown')
+        logger.info(f"ℹ️ /status command used by {user.id}. Response: {status_msg}")
+
+    # --- Private messages: one entry point, sender and state resolved once, rate limited ---
+    limiter = UserLimiter(
+        Config.USER_RATE / 60, Config.USER_BURST,
+        cooldown=Config.THROTTLE_COOLDOWN, max_cooldown=Config.THROTTLE_MAX_COOLDOWN
+    )
+    GREETINGS = ('hi', 'hello', 'join', 'start')
+
+    def classify(event):
+        """Route name and rate-limit cost for a private message (None = not ours)."""
+        if event.voice:
+            return "voice", Config.VOICE_COST
+        text = (event.text or "").strip()
+        if text.startswith('/start'):
+            return "start", 1
+        if text.startswith('/status'):
+            return "status", 1
+        if text.lower() in GREETINGS:
+            return "greet", 1
+        return None  # Other text, admin commands: left to their own handlers
+
+    @bot.on(events.NewMessage(incoming=True, func=lambda e: e.is_private))
+    @startup.gated("mongo")
+    @timed_handler("private_router")
+    async def private_router(event):
+        route = classify(event)
+        if route is None:
+            return
+        kind, cost = route
+        if event.sender_id not in Config.ADMINS:
+            throttled = limiter.check(event.sender_id, cost)
+            if throttled:
+                THROTTLED.inc(kind=kind)
+                logger.info(f"🚦 Throttled {kind} from {event.sender_id} for {throttled.seconds:.0f}s")
+                if throttled.notify:
+                    await reply(event, f"⏳ நீங்கள் மிக வேகமாக செய்திகள் அனுப்புகிறீர்கள். "
+                                       f"{math.ceil(throttled.seconds)} வினாடிகள் கழித்து மீண்டும் முயற்சிக்கவும்.")
+                return
+
+        if kind == "start":
+            await start(event)
+            return
+        user = await event.get_sender()
+        if not user:
+            logger.warning(f"❌ Could not get sender for private {kind} message")
+            return
+        remember_user(user)
+        if kind == "greet":
+            await greet(event, user)
+            return
+        record = await store.get(user.id)  # Cached; shared by everything this update does
+        if kind == "voice":
+            await voice_handler(event, user, record)
+        else:
+            await status_check(event, user, record)
+
+    # --- Admin: bulk moderation ---
+    async def run_bulk(records, action):
+        """Run `action(record)` for every record, BULK_CONCURRENCY at a time.
+
+        Returns (succeeded user_ids, [(user_id, error), ...]).
+        """
+        slots = asyncio.Semaphore(Config.BULK_CONCURRENCY)
+
+        async def one(record):
+            async with slots:
+                try:
+                    await action(record)
+                    return record["user_id"], None
+                except Exception as e:
+                    logger.warning(f"⚠️ Bulk action failed for {record['user_id']}: {e}")
+                    return record["user_id"], e
+
+        results = await asyncio.gather(*(one(r) for r in records))
+        return [uid for uid, e in results if e is None], [(uid, e) for uid, e in results if e is not None]
+
+    def bulk_summary(title, total, done, failed):
+        lines = [f"{title}: {len(done)}/{total} done"]
+        if failed:
+            lines.append(f"⚠️ {len(failed)} failed:")
+            lines += [f"`{uid}` — {type(e).__name__}" for uid, e in failed[:20]]
+            if len(failed) > 20:
+                lines.append(f"… and {len(failed) - 20} more")
+        return "\n".join(lines)
+
+    @bot.on(events.NewMessage(pattern=r'^/approve_all(@\w+)?$'))
+    @startup.gated("mongo")
+    async def approve_all(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        records = await store.list_by_status(["voice_sent"], limit=Config.BULK_LIMIT)
+        if not records:
+            await reply(event, "ℹ️ No applications waiting for approval.")
+            return
+        logger.info(f"🧹 Admin {event.sender_id} bulk-approving {len(records)} application(s)")
+        await reply(event, f"⏳ Approving {len(records)} application(s)...")
+
+        async def approve(record):
+            # Recorded under the lease and re-checked, so a concurrent click can't approve twice
+            async with store.lease(record["user_id"], Config.LEASE_SECONDS) as current:
+                if not current or current.get("status") != "voice_sent":
+                    raise Conflict(f"status is now {current and current.get('status')}")
+                peer = await input_user(record["user_id"], current)
+                if not await store.set_status(record["user_id"], "approved", from_statuses=["voice_sent"]):
+                    raise Conflict("status changed")
+            await deliver_approval(record["user_id"], peer, current.get("first_name"), "voice_sent", lane=Lane.BULK)
+
+        done, failed = await run_bulk(records, approve)
+        summary = bulk_summary(f"✅ Bulk approve by `{event.sender_id}`", len(records), done, failed)
+        await reply(event, summary, parse_mode='markdown')
+        await log_mod(summary)
+
+    @bot.on(events.NewMessage(pattern=r'^/reject_older_than(@\w+)?(\s+\S+)?$'))
+    @startup.gated("mongo")
+    async def reject_older_than(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        arg = (event.pattern_match.group(2) or "").strip()
+        seconds = parse_duration(arg)
+        if not seconds:
+            await reply(event, "ℹ️ Usage: `/reject_older_than 6h` (units: s, m, h, d)", parse_mode='markdown')
+            return
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=seconds)
+        statuses = ["pending", "voice_sent"]
+        records = await store.list_by_status(statuses, before=cutoff, limit=Config.BULK_LIMIT)
+        if not records:
+            await reply(event, "ℹ️ No matching applications.")
+            return
+        logger.info(f"🧹 Admin {event.sender_id} bulk-rejecting {len(records)} application(s) older than {seconds}s")
+        await reply(event, f"⏳ Rejecting {len(records)} application(s)...")
+
+        async def reject(record):
+            async with store.lease(record["user_id"], Config.LEASE_SECONDS):
+                # A re-join since the listing resets request_time: too young now
+                if not await store.set_status(record["user_id"], "rejected", from_statuses=statuses,
+                                              where={"request_time": {"$lt": cutoff}}):
+                    raise Conflict("status changed")
+            # Rejection stands even if the DM can't be delivered
+            peer = await input_user(record["user_id"], record)
+            await send(Lane.BULK, record["user_id"], REJECTED_MSG, peer=peer)
+
+        done, failed = await run_bulk(records, reject)
+        summary = bulk_summary(f"❌ Bulk reject (older than {arg}) by `{event.sender_id}`, DMs", len(records), done, failed)
+        await reply(event, summary, parse_mode='markdown')
+        await log_mod(summary)
+
+    @bot.on(events.NewMessage(pattern=r'^/pending(@\w+)?(\s+\d+)?$'))
+    @startup.gated("mongo")
+    async def pending_list(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        page_size = 20
+        page = max(1, int(event.pattern_match.group(2) or 1))
+        statuses = ["voice_sent", "pending"]
+        total = await store.count_by_status(statuses)
+        records = await store.list_by_status(statuses, skip=(page - 1) * page_size, limit=page_size)
+        pages = max(1, -(-total // page_size))
+        lines = [f"📋 **Open applications** ({total}) — page {page}/{pages}"]
+        now = datetime.now(timezone.utc)
+        for r in records:
+            requested = r.get("request_time")
+            age = f"{int((now - as_utc(requested)).total_seconds() // 3600)}h" if requested else "?"
+            lines.append(f"`{r['user_id']}` — {esc(r.get('first_name'))} — {r['status']} — {age}")
+        await reply(event, "\n".join(lines), parse_mode='markdown')
+
+    # --- Admin: outbound queue metrics ---
+    @bot.on(events.NewMessage(pattern='/queues'))
+    async def queues_check(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        stats = outbox.stats()
+        lines = [
+            f"`{lane:<8}` depth {stats['depth'][lane]}, "
+            f"avg {stats['latency_ms'][lane]} ms, max {stats['max_latency_ms'][lane]} ms"
+            for lane in stats["depth"]
+        ]
+        lines.append(f"sent {stats['sent']}, failed {stats['failed']}, FloodWaits {stats['flood_waits']}")
+        await reply(event, "📮 **Outbox**\n" + "\n".join(lines), parse_mode='markdown')
+
+    # --- Admin: latency / counter summary (same data as the HTTP endpoint) ---
+    @bot.on(events.NewMessage(pattern='/metrics'))
+    async def metrics_check(event):
+        if event.sender_id not in Config.ADMINS:
+            return
+        await reply(event, metrics_summary(), parse_mode='markdown')
+
+    # --- Graceful shutdown: flush buffered modlog lines while still connected ---
+    async def shutdown():
+        logger.info("🛑 Shutting down: flushing modlog and outbox...")
+        await scheduler.stop()
+        await modlog.close()
+        await outbox.drain()
+        await bot.disconnect()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown()))
+
+    # --- Mongo: client + ping with retry, then indexes and cache pre-warm (failures there aren't fatal) ---
+    async def connect_mongo():
+        if mongo is None:
+            await asyncio.get_running_loop().run_in_executor(store.executor, open_database)
+            reconciler.state = db.bot_state
+        await store.ping()
+        logger.info("✅ Connected to MongoDB")
+        try:
+            await store.ensure_indexes(archive_after=Config.ARCHIVE_AFTER)
+        except Exception as e:
+            logger.error(f"❌ Failed to ensure indexes: {e}")
+        try:
+            waiting = await store.warm("voice_sent", limit=Config.STATE_CACHE_SIZE)
+            for record in waiting:
+                if record.get("access_hash") is not None:
+                    entities.set(record["user_id"], record["access_hash"])
+            logger.info(f"🔥 Pre-warmed caches with {len(waiting)} voice_sent application(s)")
+        except Exception as e:
+            logger.warning(f"⚠️ Cache pre-warm failed: {e}")
+        if Config.VOICE_BACKEND == "queue":
+            await voice_jobs.ensure_indexes()
+            logger.info("🎧 Voice analysis runs in worker.py processes (VOICE_BACKEND=queue)")
+        if Config.DUPLICATE_ACTION != "off":
+            try:
+                await fingerprints.load(ttl=Config.FINGERPRINT_TTL)
+            except Exception as e:
+                logger.warning(f"⚠️ Loading voice fingerprints failed: {e}")
+
+    # --- Jobs that need both connections: scheduler, reconciliation, heartbeat ---
+    async def start_background():
+        await startup.wait("telegram", "mongo")
+        scheduler.start()
+        if Config.RECONCILE_ON_START:
+            # Cutoff = last time we were alive (minus slack), read before the heartbeat overwrites it
+            try:
+                since = await reconciler.startup_cutoff(margin=2 * Config.HEARTBEAT_INTERVAL)
+                reconciler.start(since, report_startup_reconcile)
+            except Exception as e:
+                logger.error(f"❌ Could not start reconciliation: {e}")
+        await reconciler.heartbeat(Config.HEARTBEAT_INTERVAL)
+
+    background = [startup.launch("mongo", connect_mongo), asyncio.create_task(start_background())]
+    if isinstance(analyzer, VoiceAnalyzer):
+        background.append(startup.launch("audio", analyzer.warm))
+    outbox.start()
+    await startup.run("telegram", lambda: bot.start(bot_token=Config.BOT_TOKEN))
     logger.info("✅ All handlers registered. Bot is live and waiting for events.")
-    await bot.run_until_disconnected()
+    try:
+        await bot.run_until_disconnected()
+    finally:
+        for task in background:
+            task.cancel()
+        await scheduler.stop()
+        await outbox.stop()
 
 # ---------------- Start ----------------
 if __name__ == '__main__':
@@ -6,7 +6,47 @@ class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     MONGO_URI = os.getenv("MONGO_URI")
     GROUP_ID = int(os.getenv("GROUP_ID"))  # -100...
-    TOPIC_ID = int(os.getenv("TOPIC_ID", "0"))
+    TOPIC_ID = int(os.getenv("TOPIC_ID", "0")) # Default to 0 if not set
     MODLOG_CHAT = int(os.getenv("MODLOG_CHAT"))
     ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x.strip()]
-    TIMEOUT = int(os.getenv("TIMEOUT", "7200"))
\ No newline at end of file
+    TIMEOUT = int(os.getenv("TIMEOUT", "7200"))  # 2 hours until the reminder
+    FINAL_TIMEOUT = int(os.getenv("FINAL_TIMEOUT", "7200"))  # Reminder → auto-reject (0 = never)
+    KICK_ON_TIMEOUT = os.getenv("KICK_ON_TIMEOUT", "false").lower() in ("1", "true", "yes")
+    REMINDER_RATE = float(os.getenv("REMINDER_RATE", "5"))  # Scheduled messages per second
+    OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))  # Concurrent Telegram sends
+    SEND_RATE = float(os.getenv("SEND_RATE", "25"))  # Global messages per second (Telegram allows ~30)
+    MODLOG_BATCH_WINDOW = float(os.getenv("MODLOG_BATCH_WINDOW", "5"))  # Seconds to buffer modlog lines (0 = off)
+    MODLOG_BATCH_SIZE = int(os.getenv("MODLOG_BATCH_SIZE", "20"))  # Flush early at this many lines
+    JOIN_CONCURRENCY = int(os.getenv("JOIN_CONCURRENCY", "8"))  # Welcome DMs in flight per join event
+    JOIN_STORM_THRESHOLD = int(os.getenv("JOIN_STORM_THRESHOLD", "30"))  # Joins/minute that start storm mode (0 = off)
+    BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "5"))  # Users handled at once by bulk commands
+    BULK_LIMIT = int(os.getenv("BULK_LIMIT", "500"))  # Max users per bulk command
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9091"))  # Prometheus-style /metrics endpoint (0 = off)
+    DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))  # Threads for blocking Mongo calls
+    STATE_CACHE_SIZE = int(os.getenv("STATE_CACHE_SIZE", "10000"))  # Application records kept in memory
+    STATE_CACHE_TTL = int(os.getenv("STATE_CACHE_TTL", "300"))  # Seconds before a cached record is re-read
+    ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "50000"))  # user_id → access_hash entries
+    ARCHIVE_AFTER = int(os.getenv("ARCHIVE_AFTER", str(90 * 86400)))  # Delete finished applications after (0 = keep)
+    VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "2"))  # Processes decoding voice notes
+    VOICE_QUEUE_LIMIT = int(os.getenv("VOICE_QUEUE_LIMIT", "8"))  # Max notes running or waiting
+    VOICE_BACKEND = os.getenv("VOICE_BACKEND", "local").lower()  # local | queue (decode in worker.py processes)
+    VOICE_JOB_TIMEOUT = int(os.getenv("VOICE_JOB_TIMEOUT", "60"))  # Seconds to wait for a queued decode
+    LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "120"))  # Per-user lock expiry if a holder dies
+    RECONCILE_ON_START = os.getenv("RECONCILE_ON_START", "true").lower() in ("1", "true", "yes")
+    RECONCILE_RATE = float(os.getenv("RECONCILE_RATE", "2"))  # Missed joins processed per second
+    RECONCILE_BATCH = int(os.getenv("RECONCILE_BATCH", "200"))  # Members diffed per $in query
+    RECONCILE_LOOKBACK = int(os.getenv("RECONCILE_LOOKBACK", "86400"))  # Window without a heartbeat / for /reconcile
+    HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL", "60"))  # Seconds between "alive" writes
+    USER_RATE = float(os.getenv("USER_RATE", "20"))  # Private-message tokens per user per minute
+    USER_BURST = int(os.getenv("USER_BURST", "10"))  # Tokens a quiet user can spend at once
+    VOICE_COST = int(os.getenv("VOICE_COST", "5"))  # Tokens per voice note (download + decode)
+    THROTTLE_COOLDOWN = int(os.getenv("THROTTLE_COOLDOWN", "60"))  # First cooldown, doubles per repeat
+    THROTTLE_MAX_COOLDOWN = int(os.getenv("THROTTLE_MAX_COOLDOWN", "3600"))
+    MIN_VOICE_SECONDS = int(os.getenv("MIN_VOICE_SECONDS", "4"))
+    MAX_VOICE_SECONDS = int(os.getenv("MAX_VOICE_SECONDS", "300"))  # 5 minutes
+    MAX_VOICE_BYTES = int(os.getenv("MAX_VOICE_BYTES", str(5 * 1024 * 1024)))  # 5 MB
+    DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "reject").lower()  # reject | flag | off
+    FINGERPRINT_INDEX_SIZE = int(os.getenv("FINGERPRINT_INDEX_SIZE", "5000"))  # Recent notes kept in memory
+    FINGERPRINT_MAX_DISTANCE = int(os.getenv("FINGERPRINT_MAX_DISTANCE", "10"))  # Bits (of 64) for a near-duplicate
+    FINGERPRINT_TTL = int(os.getenv("FINGERPRINT_TTL", str(30 * 86400)))  # Forget fingerprints after (0 = never)
@@ -0,0 +1,122 @@
+# fingerprints.py - duplicate voice note detection
+# Spammers forward one recording from many accounts. Every accepted note is
+# remembered by Telegram document id and by its envelope fingerprint
+# (voice.envelope_fingerprint) in a bounded in-memory index backed by Mongo.
+
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import NamedTuple
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import OperationFailure
+from storage import run_mongo
+from voice import FINGERPRINT_BITS, hamming
+
+logger = logging.getLogger(__name__)
+
+
+class Match(NamedTuple):
+    user_id: int
+    distance: int  # 0 for the same Telegram file
+
+
+class FingerprintIndex:
+    """Most recent `maxsize` accepted notes, oldest evicted first.
+
+    A note only counts as a duplicate when it was first submitted by a
+    *different* user; resending your own note is fine. Notes whose
+    fingerprint carries fewer than `min_bits` bits (about 5 s of audio) are
+    only matched by file id: a handful of envelope bits collide too often.
+    """
+
+    def __init__(self, collection, executor, maxsize=5000, max_distance=10, duration_tolerance=0.1, min_bits=48):
+        self.col = collection
+        self._executor = executor
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self.duration_tolerance = duration_tolerance
+        self.min_bits = min_bits
+        self._entries = OrderedDict()  # file_id -> (fingerprint, duration_ms, user_id, bits)
+
+    async def _run(self, fn, *args, **kwargs):
+        return await run_mongo(self._executor, fn, *args, **kwargs)
+
+    async def load(self, ttl=0):
+        """Ensure indexes and load the newest entries from Mongo."""
+        try:
+            await self._run(self.col.create_index, [("file_id", ASCENDING)], name="file_id_unique", unique=True)
+            if ttl > 0:
+                await self._run(self.col.create_index, [("created_at", ASCENDING)], name="created_ttl", expireAfterSeconds=ttl)
+        except OperationFailure as e:
+            logger.error(f"❌ Could not create voice_fingerprints indexes: {e}")
+        docs = await self._run(list, self.col.find(
+            {}, {"_id": 0, "file_id": 1, "fp": 1, "duration_ms": 1, "user_id": 1, "bits": 1}
+        ).sort("created_at", DESCENDING).limit(self.maxsize))
+        for doc in reversed(docs):
+            self._remember(
+                doc["file_id"], int(doc["fp"], 16), doc["duration_ms"], doc["user_id"],
+                doc.get("bits", FINGERPRINT_BITS),
+            )
+        logger.info(f"🔁 Loaded {len(docs)} voice fingerprints")
+
+    def _remember(self, file_id, fingerprint, duration_ms, user_id, bits):
+        self._entries[file_id] = (fingerprint, duration_ms, user_id, bits)
+        self._entries.move_to_end(file_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def match_file(self, file_id, user_id):
+        """Exact reuse of a Telegram file (forwarded note); no download needed."""
+        entry = self._entries.get(file_id)
+        if entry and entry[2] != user_id:
+            return Match(entry[2], 0)
+        return None
+
+    def match_audio(self, fingerprint, duration_ms, user_id, bits=FINGERPRINT_BITS):
+        """Closest earlier note from another user within `max_distance` bits.
+
+        `max_distance` is per 64 bits and shrinks with shorter fingerprints.
+        Only fingerprints of the same length are compared: their bins cover
+        different slices of the envelope otherwise.
+        """
+        if bits < self.min_bits:
+            return None
+        max_distance = self.max_distance * bits // FINGERPRINT_BITS
+        best = None
+        for fp, duration, owner, fp_bits in self._entries.values():
+            if owner == user_id or fp_bits != bits or abs(duration - duration_ms) > duration_ms * self.duration_tolerance:
+                continue
+            distance = hamming(fp, fingerprint)
+            if distance <= max_distance and (best is None or distance < best.distance):
+                best = Match(owner, distance)
+        return best
+
+    async def add(self, file_id, fingerprint, duration_ms, user_id, bits=FINGERPRINT_BITS):
+        """Remember an accepted note; the first submitter of a file stays its owner.
+
+        A flagged forward (DUPLICATE_ACTION=flag) reaches here too, so, like
+        `$setOnInsert` in Mongo, an existing entry is never overwritten.
+        """
+        if file_id not in self._entries:
+            self._remember(file_id, fingerprint, duration_ms, user_id, bits)
+        doc = await self._run(
+            self.col.find_one_and_update,
+            {"file_id": file_id},
+            {"$setOnInsert": {
+                "fp": f"{fingerprint:016x}",  # Hex: Mongo ints are signed 64-bit
+                "duration_ms": duration_ms,
+                "bits": bits,
+                "user_id": user_id,
+                "created_at": datetime.now(timezone.utc),
+            }},
+            projection={"_id": 0, "fp": 1, "duration_ms": 1, "user_id": 1, "bits": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        entry = self._entries.get(file_id)
+        if entry is None or entry[2] != doc["user_id"]:
+            # Evicted from memory but still in Mongo: the stored owner wins
+            self._remember(
+                file_id, int(doc["fp"], 16), doc["duration_ms"], doc["user_id"],
+                doc.get("bits", FINGERPRINT_BITS),
+            )
@@ -0,0 +1,133 @@
+# jobs.py - Mongo-backed voice analysis queue (VOICE_BACKEND=queue)
+# The bot process keeps the only Telegram connection and submits downloaded
+# notes here; any number of `python worker.py` processes, on any machine
+# with ffmpeg, claim them under a lease and write the VoiceStats back.
+
+import asyncio, logging, time
+from datetime import datetime, timedelta, timezone
+from bson import Binary
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import OperationFailure
+from storage import run_mongo
+from voice import FINGERPRINT_BITS, AnalyzerBusy, VoiceStats
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3  # A note that keeps killing workers is given up on
+
+
+class VoiceJobs:
+    """Job documents: queued → running (leased to one worker) → done | failed.
+
+    A worker that dies mid-job leaves an expired lease behind, and the job
+    is handed to the next worker that asks.
+    """
+
+    def __init__(self, collection, executor, lease=60, poll=0.25):
+        self.col = collection
+        self._executor = executor
+        self.lease = lease
+        self.poll = poll
+
+    async def _run(self, fn, *args, **kwargs):
+        return await run_mongo(self._executor, fn, *args, **kwargs)
+
+    async def ensure_indexes(self, ttl=3600):
+        try:
+            await self._run(self.col.create_index, [("status", ASCENDING), ("created_at", ASCENDING)], name="status_created")
+            await self._run(self.col.create_index, [("created_at", ASCENDING)], name="created_ttl", expireAfterSeconds=ttl)
+        except OperationFailure as e:
+            logger.error(f"❌ Could not create voice_jobs indexes: {e}")
+
+    # ---------------- Bot side ----------------
+    async def submit(self, audio_data):
+        result = await self._run(self.col.insert_one, {
+            "status": "queued",
+            "data": Binary(audio_data),
+            "attempts": 0,
+            "created_at": datetime.now(timezone.utc),
+        })
+        return result.inserted_id
+
+    async def wait(self, job_id, timeout):
+        """Poll until the job finishes; returns VoiceStats or raises RuntimeError/TimeoutError."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            doc = await self._run(self.col.find_one, {"_id": job_id}, {"status": 1, "result": 1, "error": 1})
+            if doc is None:
+                raise RuntimeError(f"voice job {job_id} disappeared")
+            if doc["status"] == "done":
+                r = doc["result"]
+                return VoiceStats(r["duration_ms"], r["dbfs"], int(r["fp"], 16), r.get("bits", FINGERPRINT_BITS))
+            if doc["status"] == "failed":
+                raise RuntimeError(doc.get("error") or "voice job failed")
+            await asyncio.sleep(self.poll)
+        # Nobody will read the result; stop workers from picking it up
+        await self._run(self.col.update_one, {"_id": job_id, "status": "queued"},
+                        {"$set": {"status": "failed", "error": "timed out"}, "$unset": {"data": ""}})
+        raise TimeoutError(f"voice job {job_id} not finished after {timeout}s")
+
+    # ---------------- Worker side ----------------
+    async def claim(self, owner):
+        """Oldest queued job (or one whose worker's lease ran out), leased to `owner`."""
+        now = datetime.now(timezone.utc)
+        lease_until = now + timedelta(seconds=self.lease)
+        job = await self._run(
+            self.col.find_one_and_update,
+            {"attempts": {"$lt": MAX_ATTEMPTS}, "$or": [
+                {"status": "queued"},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "owner": owner, "lease_until": lease_until},
+             "$inc": {"attempts": 1}},
+            sort=[("created_at", ASCENDING)],
+            return_document=ReturnDocument.BEFORE,
+        )
+        if job is not None:
+            job.update(status="running", owner=owner, lease_until=lease_until, attempts=job["attempts"] + 1)
+        return job
+
+    async def complete(self, job_id, owner, stats=None, error=None):
+        """Store the outcome and drop the audio; ignored if the lease was lost meanwhile."""
+        if error is None:
+            update = {"status": "done", "result": {
+                "duration_ms": stats.duration_ms,
+                "dbfs": stats.dbfs,
+                "fp": f"{stats.fingerprint:016x}",  # Hex: Mongo ints are signed 64-bit
+                "bits": stats.fingerprint_bits,
+            }}
+        else:
+            update = {"status": "failed", "error": error}
+        result = await self._run(
+            self.col.update_one,
+            {"_id": job_id, "status": "running", "owner": owner},
+            {"$set": update, "$unset": {"data": "", "lease_until": ""}},
+        )
+        return result.modified_count == 1
+
+
+class RemoteAnalyzer:
+    """Drop-in for voice.VoiceAnalyzer that hands the decode to worker.py processes.
+
+    `max_queue` bounds the notes this bot has in flight, as with the local
+    pool, so a backlog still surfaces as AnalyzerBusy instead of piling up.
+    """
+
+    def __init__(self, jobs, max_queue=8, timeout=60):
+        self.jobs = jobs
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.inflight = 0
+
+    async def analyze(self, audio_data):
+        if self.inflight >= self.max_queue:
+            raise AnalyzerBusy(f"{self.inflight} voice notes already queued")
+        self.inflight += 1
+        try:
+            job_id = await self.jobs.submit(audio_data)
+            return await self.jobs.wait(job_id, self.timeout)
+        finally:
+            self.inflight -= 1
+
+    def close(self):
+        pass
@@ -0,0 +1,100 @@
+# joins.py - join-rate tracking and join-storm mode
+# Above JOIN_STORM_THRESHOLD joins/minute, welcome DMs are collapsed into a
+# paced queue and the mod chat gets one summary instead of per-user noise.
+
+import asyncio, logging, time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+
+class JoinStorm:
+    """Sliding-window join counter that switches storm mode on and off.
+
+    `welcome(user)` sends one welcome DM and raises on failure; `alert(text)`
+    posts to the mod chat. Storm mode ends once the queue is drained and the
+    rate has fallen below half the threshold.
+    """
+
+    def __init__(self, threshold, welcome, alert, window=60, idle_check=5):
+        self.threshold = threshold
+        self.welcome = welcome
+        self.alert = alert
+        self.window = window
+        self.idle_check = idle_check
+        self.active = False
+        self._joins = deque()  # (timestamp, count)
+        self._total = 0
+        self._queue = OrderedDict()  # user_id -> user; repeated joins collapse
+        self._drainer = None
+        self._tasks = set()  # Alerts in flight
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.stats = {"joins": 0, "sent": 0, "failed": 0, "collapsed": 0, "peak": 0}
+
+    def rate(self):
+        """Joins in the last `window` seconds."""
+        cutoff = time.monotonic() - self.window
+        while self._joins and self._joins[0][0] < cutoff:
+            self._total -= self._joins.popleft()[1]
+        return self._total
+
+    def record(self, count):
+        """Count `count` joins; returns True if storm mode is (now) active."""
+        if self.threshold <= 0:
+            return False
+        self._joins.append((time.monotonic(), count))
+        self._total += count
+        rate = self.rate()
+        if self.active:
+            self.stats["joins"] += count
+            self.stats["peak"] = max(self.stats["peak"], rate)
+        elif rate >= self.threshold:
+            self.active = True
+            self._reset_stats()
+            self.stats["joins"] = rate
+            self.stats["peak"] = rate
+            logger.warning(f"🌊 Join storm started: {rate} joins in {self.window}s")
+            self._spawn(self.alert(
+                f"🌊 Join storm: {rate} joins/min. Welcome DMs are queued and per-user DM failures are summarised."
+            ))
+            # Started now, not on the first enqueue: it is what ends storm mode
+            self._start_drainer()
+        return self.active
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _start_drainer(self):
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.create_task(self._drain())
+
+    def enqueue(self, user):
+        if user.id in self._queue:
+            self.stats["collapsed"] += 1
+        self._queue[user.id] = user
+        self._start_drainer()
+
+    async def _drain(self):
+        while self._queue or self.rate() >= self.threshold / 2:
+            if not self._queue:
+                await asyncio.sleep(self.idle_check)
+                continue
+            _, user = self._queue.popitem(last=False)
+            try:
+                await self.welcome(user)
+                self.stats["sent"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.warning(f"⚠️ Storm welcome DM to {user.id} failed: {type(e).__name__}: {e}")
+        self.active = False
+        s = self.stats
+        logger.info(f"🌤️ Join storm over: {s}")
+        # Not awaited: a storm starting meanwhile must find this drainer done
+        self._spawn(self.alert(
+            f"🌤️ Join storm over: {s['joins']} joins (peak {s['peak']}/min), "
+            f"{s['sent']} welcome DMs sent, {s['failed']} failed, {s['collapsed']} duplicates collapsed."
+        ))
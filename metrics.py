@@ -0,0 +1,186 @@
+# metrics.py - in-process counters/histograms with a Prometheus text endpoint
+# No client library needed: the worker exposes plain-text metrics on a local
+# port and the admin /metrics command prints a summary of the same data.
+
+import asyncio, functools, logging, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http import HTTPStatus
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [bucket counts..., +Inf count], sum
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        counts, total = self.series.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect_left(self.buckets, value)] += 1
+        self.series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def quantile(self, q, **labels):
+        """Upper bound of the bucket holding the q-quantile (None without data)."""
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        if key not in self.series:
+            return None
+        counts, _ = self.series[key]
+        rank, seen = q * sum(counts), 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def count(self, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        return sum(self.series[key][0]) if key in self.series else 0
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total) in sorted(self.series.items()):
+            names = self.labelnames + ("le",)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Gauge:
+    """Read at scrape time from `fn`, which returns a number or {label value: number}."""
+
+    def __init__(self, name, help, fn, labelname=None):
+        self.name, self.help, self.fn, self.labelname = name, help, fn, labelname
+
+    def render(self):
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        if isinstance(value, dict):
+            for label, v in sorted(value.items()):
+                yield f"{self.name}{_labels((self.labelname,), (label,))} {v}"
+        else:
+            yield f"{self.name} {value}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.add(Histogram(
+    "guard_handler_seconds", "Time spent in each update handler", ["handler"]))
+STAGE_LATENCY = REGISTRY.add(Histogram(
+    "guard_stage_seconds", "Time per hot-path stage (download, decode, mongo, telegram)", ["stage", "op"]))
+TRANSITIONS = REGISTRY.add(Counter(
+    "guard_transitions_total", "Application status transitions", ["to"]))
+VOICE_REJECTIONS = REGISTRY.add(Counter(
+    "guard_voice_rejections_total", "Voice notes rejected, by reason", ["reason"]))
+FLOOD_WAITS = REGISTRY.add(Counter(
+    "guard_flood_waits_total", "FloodWaitErrors returned by Telegram", ["lane"]))
+THROTTLED = REGISTRY.add(Counter(
+    "guard_throttled_total", "Private messages dropped by the per-user rate limit", ["kind"]))
+HANDLER_ERRORS = REGISTRY.add(Counter(
+    "guard_handler_errors_total", "Unhandled exceptions escaping a handler", ["handler"]))
+
+
+def timed_handler(name):
+    """Decorator recording an async handler's latency (and escaping errors)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+        return wrapper
+    return decorator
+
+
+async def serve(host, port, routes=None):
+    """Minimal HTTP server: GET /metrics (plus any extra `routes` {path: fn() -> (status, text)})."""
+    routes = {"/metrics": lambda: (200, REGISTRY.render()), **(routes or {})}
+
+    async def handle(reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else "/"
+            # Drain headers
+            while (await asyncio.wait_for(reader.readline(), timeout=5)).strip():
+                pass
+            status, body = routes[path]() if path in routes else (404, "not found\n")
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"📈 Metrics endpoint on http://{host}:{port}/metrics")
+    return server
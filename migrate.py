@@ -0,0 +1,82 @@
+# migrate.py - one-off maintenance for pending_applications
+# Usage: python migrate.py [--dry-run]
+#
+# 1. Removes duplicate user_id rows (keeps the most advanced record).
+# 2. Backfills request_time and finished_at so the status/time and TTL
+#    indexes cover old records.
+# 3. Creates the indexes, replacing the non-unique user_id fallback with the
+#    unique one.
+
+import sys, asyncio, logging
+from datetime import datetime, timezone
+from pymongo import DeleteMany, MongoClient
+from config import Config
+from storage import FINISHED, PendingStore
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger("migrate")
+
+# Higher rank wins when deduplicating
+STATUS_RANK = {"started": 0, "pending": 1, "voice_sent": 2, "rejected": 3, "approved": 4}
+
+
+def dedupe(col, dry_run):
+    duplicates = col.aggregate([
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    ops, removed = [], 0
+    for group in duplicates:
+        docs = list(col.find({"_id": {"$in": group["ids"]}}, {"status": 1}))
+        # Most advanced status first, newest _id breaks ties
+        docs.sort(key=lambda d: (STATUS_RANK.get(d.get("status"), -1), d["_id"]), reverse=True)
+        drop = [d["_id"] for d in docs[1:]]
+        removed += len(drop)
+        logger.info(f"🧹 user_id {group['_id']}: keeping {docs[0]['_id']} ({docs[0].get('status')}), dropping {len(drop)}")
+        ops.append(DeleteMany({"_id": {"$in": drop}}))
+        if len(ops) >= 500:
+            if not dry_run:
+                col.bulk_write(ops, ordered=False)
+            ops = []
+    if ops and not dry_run:
+        col.bulk_write(ops, ordered=False)
+    return removed
+
+
+def backfill(col, dry_run):
+    if dry_run:
+        return (
+            col.count_documents({"request_time": {"$exists": False}}),
+            col.count_documents({"status": {"$in": list(FINISHED)}, "finished_at": {"$exists": False}}),
+        )
+    # request_time: fall back to first contact, then to the ObjectId creation time
+    requested = col.update_many(
+        {"request_time": {"$exists": False}},
+        [{"$set": {"request_time": {"$ifNull": ["$last_interaction", {"$toDate": "$_id"}]}}}],
+    )
+    # finished_at: unknown for old records, so the TTL clock starts now
+    finished = col.update_many(
+        {"status": {"$in": list(FINISHED)}, "finished_at": {"$exists": False}},
+        {"$set": {"finished_at": datetime.now(timezone.utc)}},
+    )
+    return requested.modified_count, finished.modified_count
+
+
+def main():
+    dry_run = "--dry-run" in sys.argv
+    col = MongoClient(Config.MONGO_URI).telegram_bot.pending_applications
+    logger.info(f"🚚 Migrating pending_applications{' (dry run)' if dry_run else ''}")
+
+    removed = dedupe(col, dry_run)
+    logger.info(f"✅ Duplicates removed: {removed}")
+    requested, finished = backfill(col, dry_run)
+    logger.info(f"✅ Backfilled request_time: {requested}, finished_at: {finished}")
+
+    if not dry_run:
+        store = PendingStore(col)
+        asyncio.run(store.ensure_indexes(archive_after=Config.ARCHIVE_AFTER))
+        store.close()
+
+
+if __name__ == '__main__':
+    main()
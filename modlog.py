@@ -0,0 +1,65 @@
+# modlog.py - coalescing batcher for MODLOG_CHAT notices
+# Informational lines (approvals, rejections, DM failures, ...) are buffered
+# and sent as one message, leaving MODLOG_CHAT's rate limit for the
+# actionable voice/button messages, which never go through here.
+
+import asyncio, logging
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LEN = 4000  # Telegram caps messages at 4096 characters
+
+
+class ModlogBatcher:
+    """Flush buffered lines after `window` seconds or `max_entries` lines."""
+
+    def __init__(self, flush, window=5.0, max_entries=20):
+        self._send = flush  # async callable taking the combined text
+        self.window = window
+        self.max_entries = max_entries
+        self._lines = []
+        self._timer = None
+        self._tasks = set()
+
+    def add(self, text):
+        self._lines.append(text)
+        if len(self._lines) >= self.max_entries:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._spawn_flush)
+
+    def _spawn_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        lines, self._lines = self._lines, []
+        for text in pack(lines):
+            try:
+                await self._send(text)
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to flush {text.count(chr(10)) + 1} modlog line(s): {e}")
+
+    async def close(self):
+        """Send whatever is buffered and wait for in-flight flushes."""
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def pack(lines):
+    """Join lines into as few messages as fit Telegram's length limit."""
+    chunk, size = [], 0
+    for line in lines:
+        line = line[:MAX_MESSAGE_LEN]
+        if chunk and size + len(line) + 1 > MAX_MESSAGE_LEN:
+            yield "\n".join(chunk)
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield "\n".join(chunk)
@@ -0,0 +1,212 @@
+# outbox.py - central outbound dispatcher for everything the bot sends
+# Priority lanes, Telegram-sized token buckets and FloodWait retry in one place,
+# so a raid of joins slows welcome DMs down instead of getting them dropped.
+
+import asyncio, itertools, logging, time
+from collections import OrderedDict
+from enum import IntEnum
+from telethon import errors
+from metrics import FLOOD_WAITS, STAGE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class Lane(IntEnum):
+    """Lower value = served first."""
+    ADMIN = 0     # Approve/reject callbacks
+    REPLY = 1     # Voice acks and other direct replies
+    WELCOME = 2   # Welcome DMs
+    MODLOG = 3    # MODLOG_CHAT notices
+    REMINDER = 4  # Scheduled reminders and timeouts
+    BULK = 5      # Bulk moderation commands (/approve_all, ...)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def take(self, cost=1):
+        """Consume `cost` tokens and return 0, or return the seconds to wait for them."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _Job:
+    __slots__ = ("lane", "chat_id", "factory", "future", "created", "attempts")
+
+    def __init__(self, lane, chat_id, factory, future):
+        self.lane = lane
+        self.chat_id = chat_id
+        self.factory = factory
+        self.future = future
+        self.created = time.monotonic()
+        self.attempts = 0
+
+
+class Outbox:
+    """Queue every Telegram send and pace it to Telegram's limits.
+
+    `factory` is a zero-argument callable returning the coroutine to await
+    (e.g. `lambda: bot.send_message(...)`), so a FloodWait can retry it.
+    The caller gets the send's result, or its exception, back unchanged.
+
+    Limits default to Telegram's published bot limits: ~30 messages/s
+    overall, 1/s per private chat and 20/min per group. Calls that don't
+    post a message (editing the bot's own messages, changing permissions)
+    pass `chat_id=None` and only count towards the global rate.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, workers=4, global_rate=30, private_rate=1.0, group_rate=20 / 60,
+                 max_flood_wait=300, max_retries=3):
+        self.workers = workers
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = OrderedDict()
+        self._queue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks = []
+        # Metrics
+        self.depth = {lane: 0 for lane in Lane}
+        self.latency = {lane: 0.0 for lane in Lane}  # EWMA seconds, submit → done
+        self.max_latency = {lane: 0.0 for lane in Lane}
+        self.active = 0
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"📮 Outbox started with {self.workers} workers")
+
+    async def drain(self, timeout=10):
+        """Wait until every queued send has been attempted, up to `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while (self.active or any(self.depth.values())) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        while not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            if not job.future.done():
+                job.future.set_exception(RuntimeError("Outbox stopped"))
+
+    # ---------------- Public API ----------------
+    def post(self, lane, chat_id, factory):
+        """Enqueue a send and return its future without waiting."""
+        future = asyncio.get_running_loop().create_future()
+        self._put(_Job(lane, chat_id, factory, future))
+        return future
+
+    async def send(self, lane, chat_id, factory):
+        """Enqueue a send and wait for its result."""
+        return await self.post(lane, chat_id, factory)
+
+    def set_chat_limits(self, private_rate, group_rate):
+        """Change the per-chat rates; existing buckets start over at the new rates."""
+        self.private_rate, self.group_rate = private_rate, group_rate
+        self._chats.clear()
+
+    def stats(self):
+        return {
+            "depth": {lane.name: self.depth[lane] for lane in Lane},
+            "latency_ms": {lane.name: round(self.latency[lane] * 1000) for lane in Lane},
+            "max_latency_ms": {lane.name: round(self.max_latency[lane] * 1000) for lane in Lane},
+            "sent": self.sent,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+        }
+
+    # ---------------- Internals ----------------
+    def _put(self, job):
+        self.depth[job.lane] += 1
+        self._queue.put_nowait((job.lane, next(self._seq), job))
+
+    def _requeue_later(self, job, delay):
+        self.depth[job.lane] += 1
+        asyncio.get_running_loop().call_later(
+            delay, self._queue.put_nowait, (job.lane, next(self._seq), job)
+        )
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            rate = self.private_rate if chat_id > 0 else self.group_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1 if chat_id > 0 else 3)
+            if len(self._chats) > self.MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self.depth[job.lane] -= 1
+            if job.future.done():  # Caller gave up (cancelled)
+                continue
+
+            # Per-chat limit: park the job instead of holding up the worker
+            wait = self._bucket(job.chat_id).take() if job.chat_id is not None else 0
+            if wait > 0:
+                self._requeue_later(job, wait)
+                continue
+            # Global limit applies to every job, so just wait for it
+            while (wait := self._global.take()) > 0:
+                await asyncio.sleep(wait)
+
+            job.attempts += 1
+            self.active += 1
+            try:
+                with STAGE_LATENCY.time(stage="telegram", op=job.lane.name):
+                    result = await job.factory()
+            except errors.FloodWaitError as e:
+                self.flood_waits += 1
+                FLOOD_WAITS.inc(lane=job.lane.name)
+                logger.warning(f"🌊 FloodWait {e.seconds}s on chat {job.chat_id} ({job.lane.name}), attempt {job.attempts}")
+                if job.chat_id is not None:
+                    self._bucket(job.chat_id).block(e.seconds)
+                if e.seconds <= self.max_flood_wait and job.attempts <= self.max_retries:
+                    self._requeue_later(job, e.seconds)
+                else:
+                    self._finish(job, exc=e)
+            except Exception as e:
+                self._finish(job, exc=e)
+            else:
+                self._finish(job, result=result)
+            finally:
+                self.active -= 1
+
+    def _finish(self, job, result=None, exc=None):
+        elapsed = time.monotonic() - job.created
+        self.latency[job.lane] = 0.8 * self.latency[job.lane] + 0.2 * elapsed
+        self.max_latency[job.lane] = max(self.max_latency[job.lane], elapsed)
+        if job.future.done():
+            return
+        if exc is not None:
+            self.failed += 1
+            job.future.set_exception(exc)
+        else:
+            self.sent += 1
+            job.future.set_result(result)
@@ -0,0 +1,68 @@
+# ratelimit.py - per-user anti-abuse limits for private messages
+# Checked before any download, decode or Mongo call, so one user spamming
+# voice notes or /status can't eat the bot's capacity.
+
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+from outbox import TokenBucket
+
+
+class Throttled(NamedTuple):
+    seconds: float  # Until the user may send again
+    notify: bool    # First refusal of this cooldown: tell the user once
+
+
+class _UserState:
+    __slots__ = ("bucket", "strikes", "blocked_until", "notified")
+
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.strikes = 0
+        self.blocked_until = 0.0
+        self.notified = False
+
+
+class UserLimiter:
+    """Token bucket per user with escalating cooldowns.
+
+    Emptying the bucket starts a cooldown of `cooldown` seconds, doubling
+    with every repeat offence up to `max_cooldown`. Offences are forgotten
+    after `max_cooldown` seconds of good behaviour once a cooldown ends.
+    """
+
+    def __init__(self, rate, burst, cooldown=60, max_cooldown=3600, maxsize=50000):
+        self.rate = rate
+        self.burst = burst
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.maxsize = maxsize
+        self._users = OrderedDict()  # user_id -> _UserState, least recently seen first
+
+    def _state(self, user_id):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(self.rate, self.burst)
+            if len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def check(self, user_id, cost=1):
+        """None if the message may be processed, otherwise Throttled."""
+        now = time.monotonic()
+        state = self._state(user_id)
+        if now < state.blocked_until:
+            notify, state.notified = not state.notified, True
+            return Throttled(state.blocked_until - now, notify)
+        if state.bucket.take(min(cost, self.burst)) == 0:
+            return None
+        # Counted from the end of the last cooldown: sitting one out isn't good behaviour
+        if now - state.blocked_until > self.max_cooldown:
+            state.strikes = 0
+        state.strikes += 1
+        seconds = min(self.max_cooldown, self.cooldown * 2 ** (state.strikes - 1))
+        state.blocked_until = now + seconds
+        state.notified = True
+        return Throttled(seconds, True)
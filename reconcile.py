@@ -0,0 +1,137 @@
+# reconcile.py - catch up on joins missed while the bot was offline
+# Streams the group's members newest join first, diffs each batch against
+# pending_applications with one $in query, and feeds members who joined
+# after the cutoff but have no application into the normal join path.
+
+import asyncio, logging, time
+from datetime import datetime, timedelta, timezone
+from telethon.tl import types
+from storage import run_mongo
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_ID = "heartbeat"
+
+
+class Reconciler:
+    """One sweep at a time; one batch of members is held between $in queries.
+
+    `members()` returns an async iterator of participants ordered newest
+    join first: Telethon's `iter_participants` with ChannelParticipantsRecent
+    (its default search filter has no such order). That iterator also keeps
+    the id of every member it has yielded, so memory still grows with the
+    part of the group scanned. `on_missing(users)` processes a list of
+    joined users. Only members whose join date is after the cutoff are
+    considered, so people who were in the group before the bot's downtime
+    are never DMed.
+    """
+
+    def __init__(self, members, store, on_missing, state, executor,
+                 batch_size=200, rate=2.0, lookback=86400):
+        self.members = members
+        self.store = store
+        self.on_missing = on_missing
+        self.state = state  # Collection holding the heartbeat document
+        self._executor = executor
+        self.batch_size = batch_size
+        self.rate = rate
+        self.lookback = lookback
+        self._task = None
+
+    async def _run(self, fn, *args, **kwargs):
+        return await run_mongo(self._executor, fn, *args, **kwargs)
+
+    # ---------------- Heartbeat ----------------
+    async def last_seen(self):
+        doc = await self._run(self.state.find_one, {"_id": HEARTBEAT_ID})
+        at = doc and doc.get("at")
+        return at.replace(tzinfo=timezone.utc) if at and at.tzinfo is None else at
+
+    async def heartbeat(self, interval=60):
+        """Record that the bot is alive every `interval` seconds (run as a task)."""
+        while True:
+            try:
+                await self._run(self.state.update_one, {"_id": HEARTBEAT_ID},
+                                {"$set": {"at": datetime.now(timezone.utc)}}, upsert=True)
+            except Exception as e:
+                logger.warning(f"⚠️ Heartbeat write failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def startup_cutoff(self, margin):
+        """Last heartbeat minus `margin`, or `lookback` seconds ago on a first run."""
+        seen = await self.last_seen()
+        if seen is None:
+            return datetime.now(timezone.utc) - timedelta(seconds=self.lookback)
+        return seen - timedelta(seconds=margin)
+
+    # ---------------- Sweep ----------------
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, since, report=None):
+        """Run a sweep in the background; False if one is already running.
+
+        `report(stats)` is awaited with the result.
+        """
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._sweep(since, report))
+        return True
+
+    async def _sweep(self, since, report):
+        try:
+            stats = await self.run(since)
+        except Exception as e:
+            logger.error(f"❌ Reconciliation failed: {type(e).__name__}: {e}")
+            stats = {"error": f"{type(e).__name__}: {e}"}
+        if report:
+            await report(stats)
+
+    async def run(self, since):
+        started = time.monotonic()
+        stats = {"since": since, "scanned": 0, "recent": 0, "missing": 0, "stopped_early": False}
+        logger.info(f"🔎 Reconciling group members who joined since {since:%Y-%m-%d %H:%M} UTC")
+        batch = []
+        async for user in self.members():
+            stats["scanned"] += 1
+            batch.append(user)
+            if len(batch) >= self.batch_size:
+                recent = await self._reconcile_batch(batch, since, stats)
+                batch = []
+                # Newest joins come first; a batch with nobody recent means the rest is older
+                if not recent:
+                    stats["stopped_early"] = True
+                    break
+        if batch:
+            await self._reconcile_batch(batch, since, stats)
+        stats["seconds"] = round(time.monotonic() - started, 1)
+        logger.info(f"✅ Reconciliation done: {stats}")
+        return stats
+
+    async def _reconcile_batch(self, batch, since, stats):
+        recent = [u for u in batch if self._joined_after(u, since)]
+        stats["recent"] += len(recent)
+        if not recent:
+            return 0
+        known = await self.store.known_applicants([u.id for u in recent])
+        missing = [u for u in recent if u.id not in known]
+        stats["missing"] += len(missing)
+        # Feed the join path in small chunks, `rate` users per second
+        step = max(1, int(self.rate))
+        for i in range(0, len(missing), step):
+            chunk = missing[i:i + step]
+            logger.info(f"➕ Reconciling {len(chunk)} missed join(s): {[u.id for u in chunk]}")
+            await self.on_missing(chunk)
+            await asyncio.sleep(len(chunk) / self.rate)
+        return len(recent)
+
+    @staticmethod
+    def _joined_after(user, since):
+        if getattr(user, "bot", False) or getattr(user, "deleted", False):
+            return False
+        participant = getattr(user, "participant", None)
+        if isinstance(participant, (types.ChannelParticipantAdmin, types.ChannelParticipantCreator)):
+            return False
+        joined = getattr(participant, "date", None)
+        return joined is not None and joined >= since
@@ -0,0 +1,130 @@
+# scheduler.py - single Mongo-backed loop for reminders and timeouts
+# Deadlines live on the application record (`due_at`), so nothing is lost on
+# restart and memory use does not depend on how many users are pending.
+
+import asyncio, logging, re
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger(__name__)
+
+
+def as_utc(dt):
+    """pymongo hands back naive datetimes; they are always UTC."""
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_duration(text):
+    """'90m', '6h', '2d' → seconds; a bare number is hours (None if malformed)."""
+    match = re.fullmatch(r"(\d+)\s*([smhd]?)", text.strip().lower())
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or "h"]
+
+
+class ReminderScheduler:
+    """Wakes on the next `due_at`, handles everything due in one range query.
+
+    A pending record goes through two stages:
+      1. `due_at` reached, not yet reminded → reminder sent, `due_at` pushed
+         back by `final_timeout`.
+      2. `due_at` reached again → rejected for timeout in the same write,
+         then `on_expire` does the kick and DM.
+    With `final_timeout` = 0 the second stage is disabled.
+    """
+
+    def __init__(self, store, on_reminder, on_expire, final_timeout,
+                 batch_size=100, rate=5.0, max_sleep=300):
+        self.store = store
+        self.on_reminder = on_reminder
+        self.on_expire = on_expire
+        self.final_timeout = final_timeout
+        self.batch_size = batch_size
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.max_sleep = max_sleep
+        # Bounded so a huge backlog is pulled from Mongo only as fast as it is sent
+        self._queue = asyncio.Queue(maxsize=batch_size)
+        self._wake = asyncio.Event()
+        self._next_wake = None
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()), asyncio.create_task(self._sender())]
+        logger.info("⏱️ Reminder scheduler started")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def notify(self, due_at):
+        """Call after scheduling a deadline so an earlier one cuts the sleep short."""
+        if self._next_wake is None or as_utc(due_at) < self._next_wake:
+            self._wake.set()
+
+    async def _run(self):
+        while True:
+            try:
+                handled = await self._tick()
+                if handled == self.batch_size:
+                    continue  # More may be due right now
+                await self._sleep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Reminder scheduler tick failed: {e}", exc_info=True)
+                await asyncio.sleep(min(self.max_sleep, 30))
+
+    async def _tick(self):
+        now = datetime.now(timezone.utc)
+        due = await self.store.due_applications(now, self.batch_size)
+        if not due:
+            return 0
+
+        reminders, expired, stale = [], [], []
+        for record in due:
+            if not record.get("reminded"):
+                reminders.append(record)
+            elif self.final_timeout > 0:
+                expired.append(record)
+            else:
+                stale.append(record)  # Reminded and expiry disabled: just clear due_at
+        next_due = now + timedelta(seconds=self.final_timeout) if self.final_timeout > 0 else None
+        # Advance (and expire) every record before sending so a restart never
+        # repeats a stage; only the Telegram side is left to the sender
+        expired = await self.store.advance_due(reminders, expired, stale, next_due)
+        logger.info(f"⏰ Scheduler: {len(reminders)} reminder(s), {len(expired)} expiry(ies) due")
+
+        for record in reminders:
+            await self._queue.put((self.on_reminder, record))
+        for record in expired:
+            await self._queue.put((self.on_expire, record))
+        return len(due)
+
+    async def _sleep(self):
+        next_due = await self.store.next_due()
+        now = datetime.now(timezone.utc)
+        delay = self.max_sleep
+        if next_due is not None:
+            delay = min(delay, max(0.0, (as_utc(next_due) - now).total_seconds()))
+        self._next_wake = now + timedelta(seconds=delay)
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+        self._next_wake = None
+
+    async def _sender(self):
+        while True:
+            callback, record = await self._queue.get()
+            try:
+                await callback(record)
+            except Exception as e:
+                logger.warning(f"⚠️ Scheduled action failed for {record.get('user_id')}: {e}")
+            finally:
+                self._queue.task_done()
+            if self.interval:
+                await asyncio.sleep(self.interval)
@@ -0,0 +1,105 @@
+# startup.py - dependency readiness, retry with backoff and startup timings
+# Telegram connects first; Mongo and the audio pipeline come up in the
+# background. Updates that arrive before their dependencies wait at a gate
+# instead of failing, and /readyz reports where startup is.
+
+import asyncio, functools, logging, time
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Named startup steps, each with a ready Event and its timing.
+
+    `required` steps must be ready for the process to report ready;
+    the others (e.g. the audio warm-up) are only reported.
+    """
+
+    def __init__(self, required=()):
+        self.t0 = time.monotonic()
+        self.required = tuple(required)
+        self.timings = {}   # step -> seconds since t0 when it became ready
+        self.attempts = {}  # step -> attempts so far
+        self.errors = {}    # step -> last error while retrying
+        self.queued = 0     # Handlers waiting at a gate right now
+        self._events = {}
+
+    def _event(self, name):
+        if name not in self._events:
+            self._events[name] = asyncio.Event()
+        return self._events[name]
+
+    def is_ready(self, *names):
+        return all(self._event(n).is_set() for n in names or self.required)
+
+    def mark(self, name):
+        """Record `name` as ready now."""
+        self.timings[name] = time.monotonic() - self.t0
+        self.errors.pop(name, None)
+        self._event(name).set()
+        logger.info(f"⏱️ {name} ready after {self.timings[name]:.2f}s")
+        if name in self.required and self.is_ready():
+            logger.info(f"🚀 Ready in {self.timings[name]:.2f}s — {self.breakdown()}")
+
+    async def run(self, name, fn, base_delay=1, max_delay=60):
+        """Await `fn()` until it succeeds, backing off exponentially between attempts."""
+        delay = base_delay
+        while True:
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors[name] = f"{type(e).__name__}: {e}"
+                logger.warning(f"⚠️ {name} not ready (attempt {self.attempts[name]}): {self.errors[name]}; retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(max_delay, delay * 2)
+                continue
+            self.mark(name)
+            return result
+
+    def launch(self, name, fn, **kwargs):
+        """`run` as a background task."""
+        return asyncio.create_task(self.run(name, fn, **kwargs))
+
+    async def wait(self, *names):
+        for name in names or self.required:
+            await self._event(name).wait()
+
+    def gated(self, *names):
+        """Decorator: hold a handler until `names` are ready (queues early updates)."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not self.is_ready(*names):
+                    self.queued += 1
+                    try:
+                        await self.wait(*names)
+                    finally:
+                        self.queued -= 1
+                return await fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def breakdown(self):
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in sorted(self.timings.items(), key=lambda kv: kv[1]))
+
+    # ---------------- Probes ----------------
+    def readiness(self, checks=None):
+        """(HTTP status, text) for a readiness probe; `checks` adds live {name: bool} conditions."""
+        checks = checks or {}
+        ok = self.is_ready() and all(checks.values())
+        lines = [("ready" if ok else "starting") + f" (up {time.monotonic() - self.t0:.0f}s)"]
+        for name in sorted(set(self.required) | set(self._events) | set(self.attempts)):
+            if name in self.timings:
+                lines.append(f"{name}: ready after {self.timings[name]:.2f}s")
+            elif name in self.errors:
+                lines.append(f"{name}: retrying (attempt {self.attempts[name]}): {self.errors[name]}")
+            elif name in self.attempts:
+                lines.append(f"{name}: connecting (attempt {self.attempts[name]})")
+            else:
+                lines.append(f"{name}: waiting")
+        lines += [f"{name}: {'ok' if value else 'down'}" for name, value in checks.items()]
+        lines.append(f"queued updates: {self.queued}")
+        return (200 if ok else 503), "\n".join(lines) + "\n"
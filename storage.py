@@ -0,0 +1,429 @@
+# storage.py - async repository for the pending_applications collection
+# pymongo is synchronous, so every call runs on a small bounded thread pool
+# instead of blocking the Telethon event loop.
+
+import asyncio, functools, logging, uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+from cache import MISSING
+from metrics import STAGE_LATENCY, TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+FINISHED = ("approved", "rejected")
+OPEN = ("started", "pending", "voice_sent")
+
+# Fields the handlers actually use; everything else stays in Mongo
+STATE_FIELDS = {
+    "_id": 0, "user_id": 1, "status": 1, "first_name": 1, "username": 1,
+    "access_hash": 1, "msg_id": 1, "request_time": 1, "due_at": 1, "reminded": 1,
+}
+
+
+async def run_mongo(executor, fn, *args, **kwargs):
+    """Run a blocking pymongo call on `executor`, timed as stage "mongo".
+
+    The op label is "collection.method" ("collection.find" for list(cursor)).
+    """
+    target = args[0].collection if fn is list else getattr(fn, "__self__", None)
+    op = f"{getattr(target, 'name', '?')}.{'find' if fn is list else fn.__name__}"
+    loop = asyncio.get_running_loop()
+    with STAGE_LATENCY.time(stage="mongo", op=op):
+        return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+
+class Conflict(Exception):
+    """Another handler or worker holds the user's lease."""
+
+
+def _finish_fields(status, fields):
+    """Stamp `finished_at` on terminal transitions (drives TTL archival)."""
+    if status in FINISHED:
+        fields.setdefault("finished_at", datetime.now(timezone.utc))
+    return fields
+
+
+def _transition(fields):
+    """Update document setting `fields`; moving back to an open status also drops
+    `finished_at`, or the TTL index would delete the reopened application."""
+    if fields.get("status") in OPEN:
+        return {"$set": fields, "$unset": {"finished_at": ""}}
+    return {"$set": fields}
+
+
+class PendingStore:
+    """Non-blocking access to `pending_applications`.
+
+    Every status change is a single atomic Mongo operation, so a join or a
+    voice note costs one round trip instead of a find followed by an update.
+
+    With a `cache` (cache.TTLCache), records are cached by user_id and every
+    transition writes through, so repeated reads of the same user (e.g.
+    `/status` spam) never reach Mongo.
+    """
+
+    def __init__(self, collection, max_workers=4, cache=None):
+        self.col = collection
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+
+    async def _run(self, fn, *args, **kwargs):
+        return await run_mongo(self.executor, fn, *args, **kwargs)
+
+    async def ping(self):
+        """Round trip to the server; raises if MongoDB is unreachable."""
+        await self._run(self.col.database.client.admin.command, "ping")
+
+    # ---------------- Cache ----------------
+    def _cached(self, user_id):
+        return MISSING if self.cache is None else self.cache.get(user_id)
+
+    def _remember(self, user_id, doc):
+        if self.cache is not None:
+            self.cache.set(user_id, doc)
+
+    def _merge(self, user_id, fields):
+        """Write-through for updates that don't return the document."""
+        if self.cache is None:
+            return
+        doc = self.cache.pop(user_id)
+        if doc is not MISSING and doc is not None:
+            self.cache.set(user_id, {**doc, **fields})
+
+    def _forget(self, user_id):
+        if self.cache is not None:
+            self.cache.pop(user_id)
+
+    # ---------------- Reads ----------------
+    async def get(self, user_id):
+        doc = self._cached(user_id)
+        if doc is MISSING:
+            doc = await self._run(self.col.find_one, {"user_id": user_id}, STATE_FIELDS)
+            self._remember(user_id, doc)
+        return dict(doc) if doc else None
+
+    async def list_by_status(self, statuses, before=None, skip=0, limit=50):
+        """Applications in `statuses`, oldest first; `before` filters on request_time."""
+        query = {"status": {"$in": statuses}}
+        if before is not None:
+            query["request_time"] = {"$lt": before}
+        cursor = self.col.find(
+            query,
+            {"_id": 0, "user_id": 1, "first_name": 1, "username": 1, "access_hash": 1,
+             "status": 1, "request_time": 1},
+        ).sort("request_time", ASCENDING).skip(skip).limit(limit)
+        return await self._run(list, cursor)
+
+    async def count_by_status(self, statuses):
+        return await self._run(self.col.count_documents, {"status": {"$in": statuses}})
+
+    async def warm(self, status, limit):
+        """Load up to `limit` records with `status` into the cache in one query."""
+        docs = await self._run(list, self.col.find({"status": status}, STATE_FIELDS).limit(limit))
+        for doc in docs:
+            self._remember(doc["user_id"], doc)
+        return docs
+
+    # ---------------- Indexes ----------------
+    async def ensure_indexes(self, archive_after=0):
+        """Create the indexes every query relies on (idempotent).
+
+        `archive_after` > 0 adds a TTL index that deletes approved/rejected
+        records that many seconds after they finished.
+        """
+        specs = [
+            ([("status", ASCENDING), ("request_time", ASCENDING)], {"name": "status_request_time"}),
+            ([("status", ASCENDING), ("due_at", ASCENDING)], {"name": "status_due_at"}),
+        ]
+        if archive_after > 0:
+            specs.append(([("finished_at", ASCENDING)], {"name": "finished_ttl", "expireAfterSeconds": archive_after}))
+        for keys, options in specs:
+            try:
+                await self._run(self.col.create_index, keys, **options)
+            except OperationFailure as e:
+                # e.g. ARCHIVE_AFTER changed: the old TTL index must be dropped first
+                logger.error(f"❌ Could not create index {options['name']}: {e}")
+        indexes = await self._run(self.col.index_information)
+        if "user_id_unique" not in indexes:
+            try:
+                if "user_id" in indexes:
+                    # Fallback from an earlier run; it blocks a unique index on the same key
+                    await self._run(self.col.drop_index, "user_id")
+                await self._run(self.col.create_index, [("user_id", ASCENDING)], name="user_id_unique", unique=True)
+            except OperationFailure as e:
+                # Existing duplicate user_id rows; `python migrate.py` cleans them up
+                logger.error(f"❌ Could not create unique user_id index (run `python migrate.py`): {e}")
+                await self._run(self.col.create_index, [("user_id", ASCENDING)], name="user_id")
+        logger.info("✅ pending_applications indexes ensured")
+
+    # ---------------- Scheduler ----------------
+    async def due_applications(self, now, limit):
+        """All pending records whose deadline has passed, oldest first (one range query)."""
+        cursor = self.col.find(
+            {"status": "pending", "due_at": {"$lte": now}},
+            {"_id": 0, "user_id": 1, "first_name": 1, "due_at": 1, "reminded": 1},
+        ).sort("due_at", ASCENDING).limit(limit)
+        return await self._run(list, cursor)
+
+    async def next_due(self):
+        doc = await self._run(
+            self.col.find_one,
+            {"status": "pending", "due_at": {"$type": "date"}},
+            {"_id": 0, "due_at": 1},
+            sort=[("due_at", ASCENDING)],
+        )
+        return doc["due_at"] if doc else None
+
+    async def advance_due(self, reminded, expired, stale, next_due):
+        """Move due records to their next stage in one bulk write.
+
+        `reminded` get `reminded=True` and a new deadline (or none); `expired`
+        are rejected for timeout right here, so a restart can't lose the
+        expiry; `stale` just lose their deadline. Each update only applies if
+        `due_at` is unchanged, so a concurrent re-join wins. Returns the
+        `expired` records that were actually rejected.
+        """
+        ops = []
+        for record in reminded:
+            update = {"$set": {"reminded": True, "due_at": next_due}} if next_due else \
+                     {"$set": {"reminded": True}, "$unset": {"due_at": ""}}
+            ops.append(UpdateOne({"user_id": record["user_id"], "status": "pending", "due_at": record["due_at"]}, update))
+            self._merge(record["user_id"], {"reminded": True, "due_at": next_due})
+        now = datetime.now(timezone.utc)
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # Mongo keeps milliseconds
+        fields = _finish_fields("rejected", {"status": "rejected", "reject_reason": "timeout", "finished_at": now})
+        for record in expired:
+            ops.append(UpdateOne(
+                {"user_id": record["user_id"], "status": "pending", "due_at": record["due_at"]},
+                {**_transition(fields), "$unset": {"due_at": ""}},
+            ))
+        for record in stale:
+            ops.append(UpdateOne(
+                {"user_id": record["user_id"], "status": "pending", "due_at": record["due_at"]},
+                {"$unset": {"due_at": ""}},
+            ))
+            self._merge(record["user_id"], {"due_at": None})
+        if not ops:
+            return []
+        await self._run(self.col.bulk_write, ops, ordered=False)
+        if not expired:
+            return []
+
+        # bulk_write only counts matches; read back which expiries won
+        docs = await self._run(list, self.col.find(
+            {"user_id": {"$in": [r["user_id"] for r in expired]}, "status": "rejected",
+             "reject_reason": "timeout", "finished_at": {"$gte": now}},
+            {"_id": 0, "user_id": 1},
+        ))
+        done = {doc["user_id"] for doc in docs}
+        for user_id in done:
+            self._merge(user_id, {**fields, "due_at": None})
+        if done:
+            TRANSITIONS.inc(len(done), to="rejected")
+        return [r for r in expired if r["user_id"] in done]
+
+    # ---------------- Reconciliation ----------------
+    async def known_applicants(self, user_ids):
+        """The subset of `user_ids` whose application got past 'started' (one $in query)."""
+        docs = await self._run(list, self.col.find(
+            {"user_id": {"$in": list(user_ids)}, "status": {"$ne": "started"}}, {"_id": 0, "user_id": 1}
+        ))
+        return {doc["user_id"] for doc in docs}
+
+    # ---------------- Leases ----------------
+    @asynccontextmanager
+    async def lease(self, user_id, seconds=60):
+        """Exclusive hold on one user's application, stored on the record itself.
+
+        Serialises read-modify-write sequences (voice checks, moderation)
+        across handlers, clicks and processes. Yields the fresh record, or
+        None if the user has no record (nothing to lock). Raises Conflict if
+        someone else holds it. The lease is renewed while held; a crashed
+        holder's lease expires after `seconds`.
+        """
+        token = uuid.uuid4().hex
+        now = datetime.now(timezone.utc)
+        doc = await self._run(
+            self.col.find_one_and_update,
+            {"user_id": user_id, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"lease_owner": token, "lease_until": now + timedelta(seconds=seconds)}},
+            projection=STATE_FIELDS,  # Lease fields aren't projected, so BEFORE is the current state
+            return_document=ReturnDocument.BEFORE,
+        )
+        if doc is None:
+            if await self._run(self.col.count_documents, {"user_id": user_id}, limit=1):
+                raise Conflict(f"application of {user_id} is being handled elsewhere")
+            yield None
+            return
+        self._remember(user_id, doc)
+        # Renewed while held, so a holder waiting on paced Telegram sends keeps it
+        renewal = asyncio.create_task(self._renew(user_id, token, seconds))
+        try:
+            yield dict(doc)
+        finally:
+            renewal.cancel()
+            await self._run(
+                self.col.update_one,
+                {"user_id": user_id, "lease_owner": token},
+                {"$unset": {"lease_owner": "", "lease_until": ""}},
+            )
+
+    async def _renew(self, user_id, token, seconds):
+        while True:
+            await asyncio.sleep(seconds / 3)
+            try:
+                result = await self._run(
+                    self.col.update_one,
+                    {"user_id": user_id, "lease_owner": token},
+                    {"$set": {"lease_until": datetime.now(timezone.utc) + timedelta(seconds=seconds)}},
+                )
+            except Exception as e:
+                logger.warning(f"⚠️ Could not renew the lease on {user_id}: {e}")
+                continue
+            if result.matched_count == 0:
+                logger.warning(f"⚠️ Lease on {user_id} was lost while held")
+                return
+
+    # ---------------- Transitions ----------------
+    async def mark_started(self, user):
+        """Any state → started (first contact in DM)."""
+        doc = await self._run(
+            self.col.find_one_and_update,
+            {"user_id": user.id},
+            _transition({
+                "first_name": user.first_name,
+                "username": user.username,
+                "access_hash": getattr(user, "access_hash", None),
+                "last_interaction": datetime.now(timezone.utc),
+                "status": "started",
+            }),
+            projection=STATE_FIELDS,
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._remember(user.id, doc)
+        TRANSITIONS.inc(to="started")
+
+    async def mark_pending(self, user, due_at=None):
+        """Any state → pending (joined the group), with the reminder deadline.
+
+        Returns the record as it was *before* the join (None for a brand new
+        applicant) so the caller can tell whether this is a fresh transition.
+        """
+        fields = {
+            "first_name": user.first_name,
+            "username": user.username,
+            "access_hash": getattr(user, "access_hash", None),
+            "request_time": datetime.now(timezone.utc),
+            "status": "pending",
+            "due_at": due_at,
+            "reminded": False,
+        }
+        before = await self._run(
+            self.col.find_one_and_update,
+            {"user_id": user.id},
+            _transition(fields),
+            projection=STATE_FIELDS,
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+        self._remember(user.id, {**(before or {"user_id": user.id}), **fields})
+        if before is None or before.get("status") != "pending":
+            TRANSITIONS.inc(to="pending")
+        return before
+
+    async def mark_pending_many(self, users, due_at=None):
+        """Bulk version of `mark_pending` for multi-user join events.
+
+        Two round trips for any number of users: one `$in` read of the
+        previous statuses and one unordered `bulk_write` of upserts.
+        Returns {user_id: previous record or None}.
+        """
+        ids = [user.id for user in users]
+        previous = {
+            doc["user_id"]: doc
+            for doc in await self._run(list, self.col.find(
+                {"user_id": {"$in": ids}}, {"_id": 0, "user_id": 1, "status": 1}
+            ))
+        }
+        now = datetime.now(timezone.utc)
+        ops = [
+            UpdateOne(
+                {"user_id": user.id},
+                _transition({
+                    "first_name": user.first_name,
+                    "username": user.username,
+                    "access_hash": getattr(user, "access_hash", None),
+                    "request_time": now,
+                    "status": "pending",
+                    "due_at": due_at,
+                    "reminded": False,
+                }),
+                upsert=True,
+            )
+            for user in users
+        ]
+        await self._run(self.col.bulk_write, ops, ordered=False)
+        for user_id in ids:
+            self._forget(user_id)
+        TRANSITIONS.inc(sum(1 for p in previous.values() if p.get("status") != "pending")
+                        + len(set(ids) - set(previous)), to="pending")
+        return {user_id: previous.get(user_id) for user_id in ids}
+
+    async def claim_for_voice(self, user_id):
+        """started/pending → pending when a voice note arrives.
+
+        Returns the record before the transition, or None if the user has no
+        open application. Repeat attempts are answered from the cache.
+        """
+        cached = self._cached(user_id)
+        if cached is None or (cached is not MISSING and cached.get("status") not in ("started", "pending")):
+            return None
+        if cached is not MISSING and cached.get("status") == "pending":
+            return dict(cached)  # Already pending, nothing to write
+        before = await self._run(
+            self.col.find_one_and_update,
+            {"user_id": user_id, "status": {"$in": ["started", "pending"]}},
+            _transition({"status": "pending"}),
+            projection=STATE_FIELDS,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before:
+            self._remember(user_id, {**before, "status": "pending"})
+            if before.get("status") != "pending":
+                TRANSITIONS.inc(to="pending")
+        else:
+            self._forget(user_id)
+        return before
+
+    async def set_status(self, user_id, status, from_statuses=None, where=None, **fields):
+        """Move to `status`; with `from_statuses` only if the record is still in one of them.
+
+        `where` adds query conditions the record must also meet, e.g.
+        `{"request_time": {"$lt": cutoff}}`. Returns the updated record, or
+        None if there was nothing to change.
+        """
+        query = {**(where or {}), "user_id": user_id}
+        if from_statuses is not None:
+            query["status"] = {"$in": list(from_statuses)}
+        fields = _finish_fields(status, {**fields, "status": status})
+        before = await self._run(
+            self.col.find_one_and_update,
+            query,
+            _transition(fields),
+            projection=STATE_FIELDS,
+            return_document=ReturnDocument.BEFORE,
+        )
+        if before is None:
+            self._forget(user_id)
+            return None
+        doc = {**before, **fields}
+        self._remember(user_id, doc)
+        TRANSITIONS.inc(to=status)
+        return doc
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,35 @@
+# The bot's modules live at the repository root
+import os, sys, time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces time.monotonic, which the limiters and caches read."""
+    fake = FakeClock()
+    monkeypatch.setattr(time, "monotonic", fake)
+    return fake
+
+
+@pytest.fixture
+def store():
+    """PendingStore over an in-memory mongomock collection."""
+    mongomock = pytest.importorskip("mongomock")
+    from storage import PendingStore
+    pending = PendingStore(mongomock.MongoClient().guard.pending_applications, max_workers=1)
+    yield pending
+    pending.close()
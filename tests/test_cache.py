@@ -0,0 +1,46 @@
+from cache import MISSING, TTLCache
+
+
+def test_none_is_a_cached_value(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    assert cache.get("a") is MISSING
+    cache.set("a", None)
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is MISSING
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_entries_expire(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock.advance(61)
+    assert cache.get("a") is MISSING
+    assert len(cache) == 0
+    assert cache.stats() == {"size": 0, "hits": 0, "misses": 1, "evictions": 0, "expirations": 1}
+
+
+def test_set_restarts_the_ttl(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    clock.advance(50)
+    cache.set("a", 2)
+    clock.advance(50)
+    assert cache.get("a") == 2
+
+
+def test_pop(clock):
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("a", 1)
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is MISSING
+    assert cache.stats()["hits"] == cache.stats()["misses"] == 0
@@ -0,0 +1,24 @@
+import asyncio
+
+from joins import JoinStorm
+
+
+def test_storm_ends_without_any_queued_welcome():
+    """The threshold-crossing join may enqueue nobody (all already known)."""
+    alerts = []
+
+    async def alert(text):
+        alerts.append(text)
+
+    async def welcome(user):
+        pass
+
+    async def scenario():
+        storm = JoinStorm(threshold=5, welcome=welcome, alert=alert, window=0.05, idle_check=0.01)
+        assert storm.record(5)
+        await asyncio.sleep(0.2)
+        return storm
+
+    storm = asyncio.run(scenario())
+    assert not storm.active
+    assert [text.split(":")[0] for text in alerts] == ["🌊 Join storm", "🌤️ Join storm over"]
@@ -0,0 +1,19 @@
+from modlog import MAX_MESSAGE_LEN, pack
+
+
+def test_pack_joins_short_lines():
+    assert list(pack(["a", "b", "c"])) == ["a\nb\nc"]
+    assert list(pack([])) == []
+
+
+def test_pack_splits_at_the_limit_in_order():
+    lines = [f"{i}:" + "x" * 1500 for i in range(7)]
+    messages = list(pack(lines))
+    assert all(len(m) <= MAX_MESSAGE_LEN for m in messages)
+    assert "\n".join(messages).split("\n") == lines
+    assert len(messages) == 4  # Two 1502-char lines per message
+
+
+def test_pack_truncates_an_overlong_line():
+    messages = list(pack(["y" * (MAX_MESSAGE_LEN + 500), "z"]))
+    assert messages == ["y" * MAX_MESSAGE_LEN, "z"]
@@ -0,0 +1,35 @@
+import pytest
+
+from outbox import TokenBucket
+
+
+def test_starts_full_then_waits_for_a_token(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == pytest.approx(0.5)
+
+
+def test_refill_is_capped_at_burst(clock):
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.take()
+    bucket.take()
+    clock.advance(60)
+    assert [bucket.take() for _ in range(2)] == [0, 0]
+    assert bucket.take() == pytest.approx(1)
+
+
+def test_refused_take_consumes_nothing(clock):
+    bucket = TokenBucket(rate=1, burst=5)
+    bucket.take(4)
+    assert bucket.take(3) == pytest.approx(2)
+    clock.advance(2)
+    assert bucket.take(3) == 0
+
+
+def test_block_overrides_tokens(clock):
+    bucket = TokenBucket(rate=1, burst=5)
+    bucket.block(30)
+    bucket.block(10)  # A shorter FloodWait doesn't shorten the block
+    assert bucket.take() == pytest.approx(30)
+    clock.advance(30)
+    assert bucket.take() == 0
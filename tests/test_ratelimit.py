@@ -0,0 +1,72 @@
+from ratelimit import Throttled, UserLimiter
+
+
+def exhaust(limiter, user_id):
+    """Spend the user's burst; returns the refusal that starts the cooldown."""
+    while (throttled := limiter.check(user_id)) is None:
+        pass
+    return throttled
+
+
+def test_burst_then_cooldown(clock):
+    limiter = UserLimiter(rate=1, burst=3, cooldown=60)
+    assert [limiter.check(1) for _ in range(3)] == [None, None, None]
+    assert limiter.check(1) == Throttled(60, True)
+
+
+def test_one_notice_per_cooldown(clock):
+    limiter = UserLimiter(rate=1, burst=1, cooldown=60)
+    exhaust(limiter, 1)
+    clock.advance(10)
+    assert limiter.check(1) == Throttled(50, False)
+    clock.advance(10)
+    assert limiter.check(1) == Throttled(40, False)
+
+
+def test_cooldown_doubles_up_to_the_cap(clock):
+    limiter = UserLimiter(rate=1, burst=1, cooldown=60, max_cooldown=200)
+    cooldowns = []
+    for _ in range(4):
+        throttled = exhaust(limiter, 1)
+        assert throttled.notify  # Every new cooldown is announced once
+        cooldowns.append(throttled.seconds)
+        clock.advance(throttled.seconds + 1)
+    assert cooldowns == [60, 120, 200, 200]
+
+
+def test_offences_forgotten_after_good_behaviour(clock):
+    limiter = UserLimiter(rate=1, burst=1, cooldown=60, max_cooldown=600)
+    exhaust(limiter, 1)
+    clock.advance(61)
+    assert exhaust(limiter, 1).seconds == 120
+    clock.advance(601 + 120)
+    assert exhaust(limiter, 1).seconds == 60
+
+
+def test_tokens_refill_at_rate(clock):
+    limiter = UserLimiter(rate=0.5, burst=2, cooldown=60)
+    assert limiter.check(1) is None
+    assert limiter.check(1) is None
+    clock.advance(2)  # One token back
+    assert limiter.check(1) is None
+
+
+def test_cost_is_capped_at_burst(clock):
+    """A voice note costing more than the burst is still allowed when the bucket is full."""
+    limiter = UserLimiter(rate=1, burst=3, cooldown=60)
+    assert limiter.check(1, cost=5) is None
+    assert limiter.check(1, cost=5) == Throttled(60, True)
+
+
+def test_users_are_independent(clock):
+    limiter = UserLimiter(rate=1, burst=1, cooldown=60)
+    exhaust(limiter, 1)
+    assert limiter.check(2) is None
+
+
+def test_least_recently_seen_user_is_forgotten(clock):
+    limiter = UserLimiter(rate=1, burst=1, cooldown=60, maxsize=2)
+    exhaust(limiter, 1)
+    limiter.check(2)
+    limiter.check(3)
+    assert limiter.check(1) is None
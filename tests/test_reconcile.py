@@ -0,0 +1,33 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.tl import types
+
+from reconcile import Reconciler
+
+
+def member(user_id, joined):
+    return SimpleNamespace(id=user_id, participant=types.ChannelParticipant(user_id, joined))
+
+
+def test_sweep_stops_at_the_first_batch_without_recent_joins(store):
+    now = datetime.now(timezone.utc)
+    since = now - timedelta(hours=1)
+    store.col.insert_one({"user_id": 2, "status": "pending"})
+    # Newest join first; 5 and 6 are out of order but must not be reached
+    members = [member(1, now), member(2, now), member(3, since - timedelta(hours=1)),
+               member(4, since - timedelta(hours=2)), member(5, now), member(6, now)]
+    missing = []
+
+    async def iterate():
+        for user in members:
+            yield user
+
+    async def on_missing(users):
+        missing.extend(u.id for u in users)
+
+    reconciler = Reconciler(iterate, store, on_missing, None, store.executor, batch_size=2, rate=1000)
+    stats = asyncio.run(reconciler.run(since))
+    assert missing == [1]
+    assert (stats["scanned"], stats["recent"], stats["missing"], stats["stopped_early"]) == (4, 2, 1, True)
@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from scheduler import ReminderScheduler, as_utc, parse_duration
+
+
+@pytest.mark.parametrize("text, seconds", [
+    ("45s", 45), ("90m", 5400), ("6h", 21600), ("2d", 172800),
+    ("3", 10800), (" 2 D ", 172800), ("0h", 0),
+])
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "h", "1.5h", "-1h", "5w", "6h30m"])
+def test_parse_duration_rejects_malformed(text):
+    assert parse_duration(text) is None
+
+
+def past(seconds=60):
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+def queued(scheduler):
+    items = []
+    while not scheduler._queue.empty():
+        callback, record = scheduler._queue.get_nowait()
+        items.append((callback.__name__, record["user_id"]))
+    return items
+
+
+async def on_reminder(record):
+    pass
+
+
+async def on_expire(record):
+    pass
+
+
+def test_reminder_then_expiry(store):
+    store.col.insert_one({"user_id": 1, "status": "pending", "due_at": past(), "reminded": False})
+    scheduler = ReminderScheduler(store, on_reminder, on_expire, final_timeout=3600)
+
+    assert asyncio.run(scheduler._tick()) == 1
+    assert queued(scheduler) == [("on_reminder", 1)]
+    doc = store.col.find_one({"user_id": 1})
+    assert doc["reminded"] and doc["status"] == "pending"
+    assert as_utc(doc["due_at"]) > datetime.now(timezone.utc) + timedelta(minutes=59)
+
+    store.col.update_one({"user_id": 1}, {"$set": {"due_at": past()}})
+    assert asyncio.run(scheduler._tick()) == 1
+    assert queued(scheduler) == [("on_expire", 1)]
+    doc = store.col.find_one({"user_id": 1})
+    # Rejected in Mongo before the kick/DM is even queued
+    assert (doc["status"], doc["reject_reason"]) == ("rejected", "timeout")
+    assert "finished_at" in doc and "due_at" not in doc
+    assert asyncio.run(scheduler._tick()) == 0
+
+
+def test_expiry_disabled_only_clears_the_deadline(store):
+    store.col.insert_one({"user_id": 1, "status": "pending", "due_at": past(), "reminded": True})
+    scheduler = ReminderScheduler(store, on_reminder, on_expire, final_timeout=0)
+    asyncio.run(scheduler._tick())
+    assert queued(scheduler) == []
+    doc = store.col.find_one({"user_id": 1})
+    assert doc["status"] == "pending" and "due_at" not in doc
+
+
+def test_rejoin_wins_over_expiry(store):
+    due_at = past()
+    store.col.insert_one({"user_id": 1, "status": "pending", "due_at": due_at, "reminded": True})
+    record = store.col.find_one({"user_id": 1}, {"_id": 0})
+    store.col.update_one({"user_id": 1}, {"$set": {"due_at": due_at + timedelta(hours=1)}})  # Re-joined
+
+    assert asyncio.run(store.advance_due([], [record], [], None)) == []
+    assert store.col.find_one({"user_id": 1})["status"] == "pending"
@@ -0,0 +1,113 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from storage import Conflict
+
+
+def test_unique_index_replaces_the_fallback(store):
+    store.col.insert_many([{"user_id": 1}, {"user_id": 1}])
+    asyncio.run(store.ensure_indexes())
+    assert "user_id" in store.col.index_information()
+
+    store.col.delete_one({"user_id": 1})  # What migrate.py's dedupe does
+    asyncio.run(store.ensure_indexes())
+    indexes = store.col.index_information()
+    assert indexes["user_id_unique"]["unique"] and "user_id" not in indexes
+
+
+def test_set_status_checks_the_extra_condition(store):
+    old = datetime.now(timezone.utc) - timedelta(days=1)
+    store.col.insert_one({"user_id": 1, "status": "pending", "request_time": old})
+    cutoff = old - timedelta(hours=1)  # The record is younger than this
+    assert asyncio.run(store.set_status(
+        1, "rejected", from_statuses=["pending"], where={"request_time": {"$lt": cutoff}}
+    )) is None
+    assert store.col.find_one({"user_id": 1})["status"] == "pending"
+    assert asyncio.run(store.set_status(
+        1, "rejected", from_statuses=["pending"], where={"request_time": {"$lt": old + timedelta(hours=1)}}
+    ))["status"] == "rejected"
+
+
+def test_lease_excludes_a_second_holder(store):
+    store.col.insert_one({"user_id": 1, "status": "pending"})
+
+    async def scenario():
+        async with store.lease(1, seconds=60) as record:
+            assert record["status"] == "pending"
+            with pytest.raises(Conflict):
+                async with store.lease(1):
+                    pass
+        async with store.lease(1):  # Released on exit
+            pass
+
+    asyncio.run(scenario())
+    assert "lease_owner" not in store.col.find_one({"user_id": 1})
+
+
+def test_lease_without_a_record_yields_none(store):
+    async def scenario():
+        async with store.lease(1) as record:
+            return record
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_expired_lease_can_be_taken_over(store):
+    stale = datetime.now(timezone.utc) - timedelta(seconds=1)
+    store.col.insert_one({"user_id": 1, "status": "pending", "lease_owner": "crashed", "lease_until": stale})
+
+    async def scenario():
+        async with store.lease(1) as record:
+            return record
+
+    assert asyncio.run(scenario())["status"] == "pending"
+
+
+def test_lease_is_renewed_while_held(store):
+    store.col.insert_one({"user_id": 1, "status": "pending"})
+
+    async def scenario():
+        async with store.lease(1, seconds=0.3):
+            first = store.col.find_one({"user_id": 1})["lease_until"]
+            await asyncio.sleep(0.25)
+            assert store.col.find_one({"user_id": 1})["lease_until"] > first
+
+    asyncio.run(scenario())
+
+
+def test_set_status_compare_and_set(store):
+    store.col.insert_one({"user_id": 1, "status": "pending"})
+    doc = asyncio.run(store.set_status(1, "approved", from_statuses=["pending", "voice_sent"]))
+    assert doc["status"] == "approved" and doc["finished_at"]
+    # Second click: the record already left the open statuses
+    assert asyncio.run(store.set_status(1, "rejected", from_statuses=["pending", "voice_sent"])) is None
+    assert store.col.find_one({"user_id": 1})["status"] == "approved"
+
+
+def test_reopening_clears_finished_at(store):
+    store.col.insert_one({"user_id": 1, "status": "pending"})
+    asyncio.run(store.set_status(1, "rejected"))
+    assert "finished_at" in store.col.find_one({"user_id": 1})
+
+    user = SimpleNamespace(id=1, first_name="A", username=None, access_hash=1)
+    asyncio.run(store.mark_pending(user))  # Re-joined: the TTL index must not delete it
+    doc = store.col.find_one({"user_id": 1})
+    assert doc["status"] == "pending" and "finished_at" not in doc
+
+
+def test_mark_pending_many(store):
+    store.col.insert_many([
+        {"user_id": 1, "status": "started"},
+        {"user_id": 2, "status": "approved", "finished_at": datetime.now(timezone.utc)},
+    ])
+    users = [SimpleNamespace(id=i, first_name=f"U{i}", username=None, access_hash=i) for i in (1, 2, 3)]
+    due_at = datetime.now(timezone.utc) + timedelta(hours=2)
+    previous = asyncio.run(store.mark_pending_many(users, due_at))
+
+    assert {uid: p and p["status"] for uid, p in previous.items()} == {1: "started", 2: "approved", 3: None}
+    docs = {doc["user_id"]: doc for doc in store.col.find()}
+    assert all(doc["status"] == "pending" and doc["due_at"] and not doc["reminded"] for doc in docs.values())
+    assert "finished_at" not in docs[2]
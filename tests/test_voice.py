@@ -0,0 +1,57 @@
+import random
+
+import pytest
+
+from fingerprints import FingerprintIndex
+from voice import envelope_fingerprint, fingerprint_bits, precheck_voice
+
+
+@pytest.mark.parametrize("duration, size, reason", [
+    (3, 1000, "too_short"),
+    (4, 1000, None),
+    (300, 1000, None),
+    (301, 1000, "too_long"),
+    (60, 5001, "too_large"),
+    (None, 1000, None),       # Telegram omitted the duration: left to the decoder
+    (None, None, None),
+    (None, 5001, "too_large"),
+])
+def test_precheck_voice(duration, size, reason):
+    assert precheck_voice(duration, size, min_seconds=4, max_seconds=300, max_bytes=5000) == reason
+
+
+def speech_like(seed, frames):
+    """Syllable-ish frame energies: random levels with pauses."""
+    rng, level, energies = random.Random(seed), 0.0, []
+    for _ in range(frames):
+        if rng.random() < 0.15:
+            level = 0.0
+        elif rng.random() < 0.5:
+            level = rng.uniform(0.2, 1.0)
+        energies.append(level * 1e6 + 1e3)
+    return energies
+
+
+def test_short_notes_carry_fewer_bits():
+    assert fingerprint_bits(40) == 39
+    assert fingerprint_bits(65) == fingerprint_bits(3000) == 64
+    rising = [float(i) for i in range(40)]
+    assert envelope_fingerprint(rising, fingerprint_bits(40)) == 2 ** 39 - 1
+
+
+@pytest.mark.parametrize("frames", [40, 50, 65, 100])
+def test_distinct_short_notes_do_not_match(frames):
+    index = FingerprintIndex(None, None)
+    bits = fingerprint_bits(frames)
+    for seed in range(40):
+        fingerprint = envelope_fingerprint(speech_like(seed, frames), bits)
+        assert index.match_audio(fingerprint, frames * 100, seed, bits) is None
+        index._remember(seed, fingerprint, frames * 100, seed, bits)
+
+
+def test_near_copy_matches():
+    index = FingerprintIndex(None, None)
+    energies = speech_like(1, 100)
+    index._remember("a", envelope_fingerprint(energies), 10000, 1, 64)
+    louder = [e * 2.5 for e in energies]
+    assert index.match_audio(envelope_fingerprint(louder), 10000, 2).user_id == 1
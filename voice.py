@@ -0,0 +1,206 @@
+# voice.py - voice note analysis off the event loop
+# ffmpeg decodes the OGG/Opus note to raw PCM which is consumed chunk by chunk,
+# so peak memory stays flat no matter how long the note is.
+
+import asyncio, logging, math, multiprocessing, operator, shutil, subprocess, sys, threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+FFMPEG = shutil.which("ffmpeg")
+HAS_AUDIO = FFMPEG is not None
+
+SAMPLE_RATE = 16000      # Mono 16 kHz is plenty for duration/loudness
+CHUNK_BYTES = 64 * 1024  # PCM bytes handled per step (~2 s of audio)
+MAX_AMPLITUDE = 1 << 15  # s16 full scale, same reference pydub uses for dBFS
+FINGERPRINT_BITS = 64
+
+# Pool workers must not be forked from the bot: by the time the pool starts,
+# pymongo's client and the executor threads are running, and pymongo doesn't
+# support forking a process that holds an open MongoClient.
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class VoiceStats(NamedTuple):
+    duration_ms: int
+    dbfs: float
+    fingerprint: int  # Energy-envelope hash, see `envelope_fingerprint`
+    fingerprint_bits: int = FINGERPRINT_BITS  # Bits it carries (fewer for short notes)
+
+
+def fingerprint_bits(frames):
+    """Bits an envelope of `frames` energy frames can carry: every bin needs a frame of its own."""
+    return max(0, min(FINGERPRINT_BITS, frames - 1))
+
+
+def envelope_fingerprint(energies, bits=FINGERPRINT_BITS):
+    """Compact hash of the loudness envelope.
+
+    The frame energies are averaged into `bits + 1` equal bins; bit i says
+    whether bin i+1 is louder than bin i. Re-encoding or changing the
+    volume barely moves it, so near-identical recordings differ in only a
+    few bits. `bits` must be at most `fingerprint_bits(len(energies))`,
+    otherwise some bins share a frame and their bits are always 0.
+    """
+    if not energies or bits <= 0:
+        return 0
+    n = len(energies)
+    bins = []
+    for i in range(bits + 1):
+        lo = i * n // (bits + 1)
+        hi = max(lo + 1, (i + 1) * n // (bits + 1))
+        seg = energies[lo:min(hi, n)] or energies[-1:]
+        bins.append(sum(seg) / len(seg))
+    value = 0
+    for i in range(bits):
+        value = (value << 1) | (bins[i + 1] > bins[i])
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class AnalyzerBusy(Exception):
+    """Raised when too many voice notes are already queued for analysis."""
+
+
+def precheck_voice(duration, size, min_seconds, max_seconds, max_bytes):
+    """Gate on the metadata Telegram sends with the message, before any download.
+
+    `duration` (seconds) and `size` (bytes) may be None when Telegram omits
+    them; those checks are then left to the decoder. Returns a rejection
+    reason or None if the note is worth downloading.
+    """
+    if duration is not None and duration < min_seconds:
+        return "too_short"
+    if duration is not None and duration > max_seconds:
+        return "too_long"
+    if size is not None and size > max_bytes:
+        return "too_large"
+    return None
+
+
+def _feed(stdin, data):
+    try:
+        stdin.write(data)
+    except (BrokenPipeError, OSError):
+        pass  # ffmpeg gave up early; the exit code tells the story
+    finally:
+        try:
+            stdin.close()
+        except OSError:
+            pass
+
+
+def analyze_voice(audio_data, sample_rate=SAMPLE_RATE):
+    """Return VoiceStats for an OGG voice note. Runs inside a pool worker."""
+    proc = subprocess.Popen(
+        [FFMPEG or "ffmpeg", "-nostdin", "-loglevel", "error",
+         "-f", "ogg", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    # Feed stdin from a thread so a full stdout pipe can never deadlock us
+    feeder = threading.Thread(target=_feed, args=(proc.stdin, audio_data), daemon=True)
+    feeder.start()
+
+    samples = 0
+    sum_sq = 0
+    carry = b""
+    frame_samples = sample_rate // 10  # 100 ms energy frames for the fingerprint
+    energies = []  # One float per frame, a few KB even for long notes
+    frame_sum = frame_fill = 0
+    try:
+        while True:
+            chunk = proc.stdout.read(CHUNK_BYTES)
+            if not chunk:
+                break
+            if carry:
+                chunk, carry = carry + chunk, b""
+            if len(chunk) % 2:
+                chunk, carry = chunk[:-1], chunk[-1:]
+            pcm = array("h", chunk)
+            if sys.byteorder == "big":
+                pcm.byteswap()
+            samples += len(pcm)
+            pos = 0
+            while pos < len(pcm):
+                take = min(frame_samples - frame_fill, len(pcm) - pos)
+                seg = pcm[pos:pos + take]
+                energy = sum(map(operator.mul, seg, seg))
+                sum_sq += energy
+                frame_sum += energy
+                frame_fill += take
+                pos += take
+                if frame_fill == frame_samples:
+                    energies.append(frame_sum / frame_samples)
+                    frame_sum = frame_fill = 0
+    finally:
+        proc.stdout.close()
+        returncode = proc.wait()
+        feeder.join()
+
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with code {returncode}")
+
+    if frame_fill:
+        energies.append(frame_sum / frame_fill)
+    duration_ms = samples * 1000 // sample_rate
+    bits = fingerprint_bits(len(energies))
+    fingerprint = envelope_fingerprint(energies, bits)
+    if not sum_sq:
+        return VoiceStats(duration_ms, -math.inf, fingerprint, bits)
+    rms = math.sqrt(sum_sq / samples)
+    return VoiceStats(duration_ms, 20 * math.log10(rms / MAX_AMPLITUDE), fingerprint, bits)
+
+
+def probe_ffmpeg():
+    """First line of `ffmpeg -version`; run in the pool to start a worker and check the binary."""
+    out = subprocess.run([FFMPEG, "-hide_banner", "-version"], capture_output=True, check=True, timeout=30)
+    return out.stdout.decode(errors="replace").splitlines()[0]
+
+
+class VoiceAnalyzer:
+    """Bounded process pool for `analyze_voice`.
+
+    At most `max_queue` notes may be running or waiting at once; beyond that
+    `analyze` raises AnalyzerBusy so the handler can ask the user to retry.
+    """
+
+    def __init__(self, workers=2, max_queue=8):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.inflight = 0
+        self._pool = self._new_pool()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+    async def analyze(self, audio_data):
+        if self.inflight >= self.max_queue:
+            raise AnalyzerBusy(f"{self.inflight} voice notes already queued")
+        self.inflight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, analyze_voice, audio_data)
+        except BrokenProcessPool:
+            logger.error("💥 Voice analysis pool crashed; restarting it")
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = self._new_pool()
+            raise
+        finally:
+            self.inflight -= 1
+
+    async def warm(self):
+        """Start every worker process and check ffmpeg before the first note arrives."""
+        loop = asyncio.get_running_loop()
+        versions = await asyncio.gather(*(loop.run_in_executor(self._pool, probe_ffmpeg) for _ in range(self.workers)))
+        logger.info(f"🎧 Voice pipeline ready: {self.workers} worker(s), {versions[0]}")
+
+    def close(self, wait=False):
+        """Stop the pool; `wait=True` also joins the processes (clean interpreter exit)."""
+        self._pool.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,84 @@
+# worker.py - voice analysis worker for VOICE_BACKEND=queue
+# Usage: python worker.py
+#
+# Claims voice notes submitted by bot.py from the voice_jobs collection and
+# decodes them with ffmpeg in a local process pool (VOICE_WORKERS wide).
+# Run as many as needed, on any machine that can reach MongoDB; only bot.py
+# talks to Telegram.
+#
+# Opt-in: the Procfile's `voice` process exits right away unless
+# VOICE_BACKEND=queue. It only needs MongoDB, not the bot's Telegram
+# settings, so it reads its own few variables instead of config.Config.
+
+import os, sys, signal, socket, asyncio, logging
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import MongoClient
+from jobs import VoiceJobs
+from voice import HAS_AUDIO, VoiceAnalyzer
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger("worker")
+
+# Same variables and defaults as config.Config
+MONGO_URI = os.getenv("MONGO_URI")
+VOICE_BACKEND = os.getenv("VOICE_BACKEND", "local").lower()
+DB_WORKERS = int(os.getenv("DB_WORKERS", "4"))  # Threads for blocking Mongo calls
+VOICE_WORKERS = int(os.getenv("VOICE_WORKERS", "2"))  # Processes decoding voice notes
+VOICE_JOB_TIMEOUT = int(os.getenv("VOICE_JOB_TIMEOUT", "60"))  # Lease on a claimed job
+
+
+async def process(jobs, analyzer, owner, job):
+    try:
+        stats = await analyzer.analyze(bytes(job["data"]))
+    except Exception as e:
+        logger.warning(f"⚠️ Voice job {job['_id']} failed: {type(e).__name__}: {e}")
+        await jobs.complete(job["_id"], owner, error=f"{type(e).__name__}: {e}")
+        return
+    if await jobs.complete(job["_id"], owner, stats=stats):
+        logger.info(f"✅ Voice job {job['_id']} done ({stats.duration_ms} ms, {stats.dbfs:.1f} dBFS)")
+    else:
+        logger.warning(f"⚠️ Lease on voice job {job['_id']} expired before it finished")
+
+
+async def main():
+    if VOICE_BACKEND != "queue":
+        logger.info(f"💤 VOICE_BACKEND={VOICE_BACKEND}: bot.py decodes voice notes itself, no worker needed")
+        return
+    if not HAS_AUDIO:
+        sys.exit("ffmpeg not found: a voice worker needs it")
+    mongo = MongoClient(MONGO_URI)
+    executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="mongo")
+    jobs = VoiceJobs(mongo.telegram_bot.voice_jobs, executor, lease=VOICE_JOB_TIMEOUT)
+    await jobs.ensure_indexes()
+    analyzer = VoiceAnalyzer(workers=VOICE_WORKERS, max_queue=VOICE_WORKERS)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logger.info(f"🎧 Voice worker {owner} started with {VOICE_WORKERS} decoder(s)")
+    running = set()
+    while not stop.is_set():
+        job = await jobs.claim(owner) if len(running) < VOICE_WORKERS else None
+        if job is None:
+            # Idle or at capacity: wait a poll interval (or for a shutdown signal)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=jobs.poll)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        task = asyncio.create_task(process(jobs, analyzer, owner, job))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    logger.info(f"🛑 Finishing {len(running)} voice job(s) before exit")
+    await asyncio.gather(*running, return_exceptions=True)
+    analyzer.close()
+    executor.shutdown(wait=False)
+    mongo.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())